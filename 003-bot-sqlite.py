@@ -43,13 +43,12 @@ from fastapi.responses import RedirectResponse
 from pipecat_ai_small_webrtc_prebuilt.frontend import SmallWebRTCPrebuiltUI
 from pipecat.transports.network.webrtc_connection import SmallWebRTCConnection
 
-import aiofiles
-import io
-import sqlite3
-import wave
+from contextlib import asynccontextmanager
 from pipecat.frames.frames import (
     Frame,
+    InputAudioRawFrame,
     StartFrame,
+    UserStartedSpeakingFrame,
     UserStoppedSpeakingFrame,
     BotStartedSpeakingFrame,
 )
@@ -58,6 +57,10 @@ from pipecat.processors.audio.audio_buffer_processor import AudioBufferProcessor
 from pipecat.processors.frame_processor import FrameProcessor, FrameDirection
 from pipecat.processors.transcript_processor import TranscriptProcessor
 
+from recording import StreamingWavRecorder
+from turn_observers import ServiceMetricsObserver, StageTimingObserver
+from turn_store import INSERT_TURN_SQL, TurnStore
+
 import uvicorn
 
 load_dotenv(override=True)
@@ -82,17 +85,37 @@ schema_play_random_game = FunctionSchema(
 
 tools = ToolsSchema(standard_tools=[schema_play_random_game])
 
+# One store for every session in this process. It owns the only writer connection, and
+# turns are group-committed from a background thread so that database writes never
+# block the audio pipeline.
+turn_store = TurnStore()
+
+# The audio buffer hands us the recording in chunks of this many bytes per track (about
+# 5s of 24kHz audio), and we stream each one to disk. Memory use per call stays bounded
+# no matter how long the call runs.
+RECORDING_BUFFER_SIZE = 256 * 1024
+
+# Record the user on the left channel and the bot on the right, so audio_analysis.py can
+# tell who was speaking when.
+RECORDING_CHANNELS = 2
+
 
 class TurnTracker(FrameProcessor):
-    def __init__(self, session_id: str):
+    def __init__(self, session_id: str, store: TurnStore):
         super().__init__()
 
         self.session_id = session_id
+        self._store = store
         self._init_turn_values()
 
-        self.db_connection = sqlite3.connect(
-            "./db-and-recordings/conversation_turns.db"
-        )
+        # Position in the conversation recording, counted in samples of input audio.
+        # The audio buffer keeps the bot track aligned to the user track, so every
+        # input sample after start_recording() is one (stereo) frame of the recording.
+        self._recording = False
+        self._recording_samples = 0
+        self._recording_sample_rate = None
+        self._turn_start_sample = None
+        self._user_started_speaking_sample = None
 
     def _init_turn_values(self):
         self.turn_number = 0
@@ -102,19 +125,42 @@ class TurnTracker(FrameProcessor):
         self.llm_response_text = ""
         self.voice_to_voice_response_time = 0
         self.interrupted = False
+        self.audio_start_sample = None
+        self.audio_end_sample = None
+        self.audio_sample_rate = None
         self._user_stopped_speaking_ts = 0
 
+    def start_recording(self):
+        """Call this alongside AudioBufferProcessor.start_recording()."""
+        self._recording = True
+        self._recording_samples = 0
+        # the first turn (the bot's greeting) is already underway
+        self._turn_start_sample = 0
+
     async def process_frame(self, frame: Frame, direction: FrameDirection):
         await super().process_frame(frame, direction)
 
-        # calculate voice-to-voice time
+        # calculate voice-to-voice time, on a monotonic clock
         if isinstance(frame, UserStoppedSpeakingFrame) or isinstance(frame, StartFrame):
-            self._user_stopped_speaking_ts = time.time()
+            self._user_stopped_speaking_ts = time.perf_counter()
         elif isinstance(frame, BotStartedSpeakingFrame):
             self.voice_to_voice_response_time = (
-                time.time() - self._user_stopped_speaking_ts
+                time.perf_counter() - self._user_stopped_speaking_ts
             )
 
+        # track where each turn starts in the recording
+        if isinstance(frame, InputAudioRawFrame):
+            if self._recording:
+                self._recording_samples += frame.num_frames
+                self._recording_sample_rate = frame.sample_rate
+        elif isinstance(frame, UserStartedSpeakingFrame):
+            self._user_started_speaking_sample = self._recording_samples
+            if self._turn_start_sample is None:
+                self._turn_start_sample = self._recording_samples
+        elif isinstance(frame, BotStartedSpeakingFrame):
+            if self._turn_start_sample is None:
+                self._turn_start_sample = self._recording_samples
+
         await self.push_frame(frame, direction)
 
     async def set_user_speech_text(self, text: str):
@@ -139,6 +185,21 @@ class TurnTracker(FrameProcessor):
         self.turn_start_time = turn_start_time
         self.turn_end_time = turn_end_time
         self.interrupted = interrupted
+        if self._recording:
+            self.audio_start_sample = self._turn_start_sample or 0
+            self.audio_sample_rate = self._recording_sample_rate
+            if (
+                interrupted
+                and self._user_started_speaking_sample is not None
+                and self._user_started_speaking_sample > self.audio_start_sample
+            ):
+                # the user barged in: this turn ends, and the next one starts, where
+                # they started speaking
+                self.audio_end_sample = self._user_started_speaking_sample
+                self._turn_start_sample = self._user_started_speaking_sample
+            else:
+                self.audio_end_sample = self._recording_samples
+                self._turn_start_sample = None
         # handle either order of end_turn or set_llm_response_text() - if we
         # have the llm response text, we can save the turn now.
         if self.llm_response_text:
@@ -148,22 +209,23 @@ class TurnTracker(FrameProcessor):
         logger.info(
             f"Saving turn {self.turn_number} - user speech: {self.user_speech_text}, llm response: {self.llm_response_text}, voice-to-voice response time: {self.voice_to_voice_response_time}, interrupted: {self.interrupted}"
         )
-        cursor = self.db_connection.cursor()
-        cursor.execute(
-            "INSERT INTO conversation_turn (session_id, turn_number, turn_start_time, turn_end_time, user_speech_text, llm_response_text, voice_to_voice_response_time, interrupted) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-            (
-                self.session_id,
-                self.turn_number,
-                self.turn_start_time,
-                self.turn_end_time,
-                self.user_speech_text,
-                self.llm_response_text,
-                self.voice_to_voice_response_time,
-                self.interrupted,
-            ),
+        row = (
+            self.session_id,
+            self.turn_number,
+            self.turn_start_time,
+            self.turn_end_time,
+            self.user_speech_text,
+            self.llm_response_text,
+            self.voice_to_voice_response_time,
+            self.interrupted,
+            self.audio_start_sample,
+            self.audio_end_sample,
+            self.audio_sample_rate,
         )
-        self.db_connection.commit()
+        # reset before handing off, so frames that arrive while we wait on a full
+        # writer queue are counted toward the next turn
         self._init_turn_values()
+        await self._store.enqueue(INSERT_TURN_SQL, row)
 
 
 async def main(transport: BaseTransport):
@@ -185,9 +247,15 @@ async def main(transport: BaseTransport):
     )
 
     turn_observer = TurnTrackingObserver()
-    audio_buffer = AudioBufferProcessor()
+    stage_timing = StageTimingObserver(session_id, turn_store)
+    service_metrics = ServiceMetricsObserver(session_id, turn_store)
+    audio_buffer = AudioBufferProcessor(
+        num_channels=RECORDING_CHANNELS, buffer_size=RECORDING_BUFFER_SIZE
+    )
+    recorder = StreamingWavRecorder(f"db-and-recordings/conversation-{session_id}.wav")
 
-    turn_tracker = TurnTracker(session_id)
+    turn_store.register_session(session_id)
+    turn_tracker = TurnTracker(session_id, turn_store)
     transcript_processor = TranscriptProcessor()
 
     context = OpenAILLMContext(
@@ -245,7 +313,7 @@ Remember, your responses should be short. Just one or two sentences, usually."""
 
     task = PipelineTask(
         pipeline,
-        observers=[turn_observer],
+        observers=[turn_observer, stage_timing, service_metrics],
         params=PipelineParams(
             allow_interruptions=True,
             enable_metrics=True,
@@ -258,13 +326,16 @@ Remember, your responses should be short. Just one or two sentences, usually."""
     async def on_client_connected(transport, client):
         logger.info(f"Client connected: {client}")
         await audio_buffer.start_recording()
+        turn_tracker.start_recording()
         # Kick off the conversation
         await task.queue_frames([context_aggregator.user().get_context_frame()])
 
     @transport.event_handler("on_client_disconnected")
     async def on_client_disconnected(transport, client):
         logger.info(f"Client disconnected: {client}")
+        # stop_recording() delivers the last partial chunk through on_audio_data
         await audio_buffer.stop_recording()
+        await recorder.close()
         await task.cancel()
 
     @turn_observer.event_handler("on_turn_ended")
@@ -281,6 +352,8 @@ Remember, your responses should be short. Just one or two sentences, usually."""
             turn_end_time=end_time,
             interrupted=was_interrupted,
         )
+        await stage_timing.end_turn(turn_number)
+        await service_metrics.end_turn(turn_number)
 
     @transcript_processor.event_handler("on_transcript_update")
     async def on_transcript_update(processor, frame):
@@ -294,22 +367,19 @@ Remember, your responses should be short. Just one or two sentences, usually."""
     @audio_buffer.event_handler("on_audio_data")
     async def on_audio_data(buffer, audio, sample_rate, num_channels):
         try:
-            filename = f"db-and-recordings/conversation-{session_id}.wav"
-            logger.info(f"Saving {len(audio)} bytes of audio data to {filename}")
-            with io.BytesIO() as buffer:
-                with wave.open(buffer, "wb") as wf:
-                    wf.setsampwidth(2)
-                    wf.setnchannels(num_channels)
-                    wf.setframerate(sample_rate)
-                    wf.writeframes(audio)
-                async with aiofiles.open(filename, "wb") as file:
-                    await file.write(buffer.getvalue())
+            await recorder.write(audio, sample_rate, num_channels)
         except Exception as e:
             logger.exception(f"Error in on_audio_data: {str(e)}")
 
     runner = PipelineRunner(handle_sigint=False, force_gc=True)
 
-    await runner.run(task)
+    try:
+        await runner.run(task)
+    finally:
+        await recorder.close()
+        logger.info(f"Saved {recorder.bytes_written} bytes of audio data to {recorder.path}")
+        await service_metrics.flush()
+        await turn_store.unregister_session(session_id)
 
 
 #
@@ -356,7 +426,7 @@ async def bot(args: SessionArguments):
             )
 
         await main(transport)
-        logger.info("Bot process completed")
+        logger.info(f"Bot process completed, turn store stats: {turn_store.stats()}")
     except Exception as e:
         logger.exception(f"Error in bot process: {str(e)}")
         raise
@@ -365,7 +435,14 @@ async def bot(args: SessionArguments):
 # Run the bot locally. This is useful for testing and development.
 def local():
     try:
-        app = FastAPI()
+
+        @asynccontextmanager
+        async def lifespan(app: FastAPI):
+            yield
+            # commit any turns that are still queued before the process exits
+            await turn_store.close()
+
+        app = FastAPI(lifespan=lifespan)
 
         # Store connections by pc_id
         pcs_map: Dict[str, SmallWebRTCConnection] = {}
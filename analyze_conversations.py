@@ -1,12 +1,53 @@
 import argparse
+import collections
+import glob
+import itertools
 import sqlite3
 import datetime
 import os
+import pathlib
 import sys
+import time
+
+import migrations
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "db-and-recordings/conversation_turns.db")
 
 
+def sorted_percentile(data_sorted, percent):
+    """
+    Return the percentile (percent in [0, 1]) of data that is already sorted, using
+    linear interpolation (numpy's default method).
+    """
+    if not data_sorted:
+        return None
+    idx = percent * (len(data_sorted) - 1)
+    lower = int(idx)
+    upper = min(lower + 1, len(data_sorted) - 1)
+    weight = idx - lower
+    return data_sorted[lower] * (1 - weight) + data_sorted[upper] * weight
+
+
+_np_percentile = None
+
+
+def _numpy_percentile():
+    # Look numpy up once, not on every call. Returns None if it isn't installed.
+    global _np_percentile
+    if _np_percentile is None:
+        try:
+            import numpy as np
+            import inspect
+            # Check if 'method' is in the signature (NumPy >= 1.22)
+            if 'method' in inspect.signature(np.percentile).parameters:
+                _np_percentile = lambda data, q: np.percentile(data, q, method="linear")
+            else:
+                _np_percentile = lambda data, q: np.percentile(data, q, interpolation="linear")
+        except ImportError:
+            _np_percentile = False
+    return _np_percentile or None
+
+
 def percentile(data, percent):
     """
     Return the percentile of the data (percent in [0, 1]).
@@ -14,77 +55,503 @@ def percentile(data, percent):
     """
     if not data:
         return None
-    try:
-        import numpy as np
-        import inspect
-        np_percentile = np.percentile
-        # Check if 'method' is in the signature (NumPy >= 1.22)
-        if 'method' in inspect.signature(np_percentile).parameters:
-            return float(np_percentile(data, percent * 100, method="linear"))
-        else:
-            return float(np_percentile(data, percent * 100, interpolation="linear"))
-    except ImportError:
-        # Manual calculation (nearest-rank method for small N)
-        data_sorted = sorted(data)
-        idx = percent * (len(data_sorted) - 1)
-        lower = int(idx)
-        upper = min(lower + 1, len(data_sorted) - 1)
-        weight = idx - lower
-        return data_sorted[lower] * (1 - weight) + data_sorted[upper] * weight
-
-
-def list_sessions(show_percentiles=False):
+    np_percentile = _numpy_percentile()
+    if np_percentile:
+        return float(np_percentile(data, percent * 100))
+    return sorted_percentile(sorted(data), percent)
+
+
+def format_start_time(timestamp):
+    # Format the timestamp to local time, human readable
+    return datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def connect():
     conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
+    migrations.migrate(conn)
+    return conn
+
+
+def list_sessions(show_percentiles=False, cached=False):
+    conn = connect()
+    if show_percentiles:
+        if cached:
+            list_sessions_with_cached_percentiles(conn)
+        else:
+            list_sessions_with_percentiles(conn)
+        conn.close()
+        return
+    # the session table is kept up to date as turns are inserted, so this is an index
+    # scan rather than a GROUP BY over every turn
+    cursor = conn.execute(
         """
-        SELECT session_id, MIN(turn_start_time), COUNT(*)
-        FROM conversation_turn
-        GROUP BY session_id
-        ORDER BY MIN(turn_start_time) ASC
+        SELECT session_id, first_turn_start_time, num_turns
+        FROM session
+        ORDER BY first_turn_start_time ASC
         """
     )
-    sessions = cursor.fetchall()
-    if not sessions:
+    found = False
+    for session_id, first_turn_start, num_turns in cursor:
+        if not found:
+            print(f"{'Session ID':<25} {'First Turn Start':<25} {'Num Turns':<10}")
+            print("-" * 65)
+            found = True
+        print(f"{session_id:<25} {format_start_time(first_turn_start):<25} {num_turns:<10}")
+    if not found:
+        print("No sessions found.")
+    conn.close()
+
+
+def parse_percents(text):
+    # "50,95,99" -> [0.5, 0.95, 0.99]
+    return [float(p) / 100 for p in text.split(",") if p.strip()]
+
+
+def format_seconds(value):
+    return f"{value:.3f}" if value == value else "-"  # NaN -> "-"
+
+
+def load_analytics_turns(parquet_dir=None):
+    import latency_analytics
+
+    if parquet_dir:
+        return latency_analytics.load_turns_parquet(parquet_dir)
+    conn = connect()
+    turns = latency_analytics.load_turns(conn)
+    conn.close()
+    return turns
+
+
+def print_cache_staleness(conn, percents):
+    # plain SQL, so reading the cache doesn't need numpy
+    watermarks = dict(conn.execute("SELECT percent, last_turn_id FROM session_percentile_state"))
+    for percent in percents:
+        turns = None
+        if percent in watermarks:
+            turns = conn.execute(
+                "SELECT COUNT(*) FROM conversation_turn WHERE id > ?", (watermarks[percent],)
+            ).fetchone()[0]
+        if turns is None:
+            print(f"(P{percent * 100:g} has never been cached; run refresh-caches --percentiles {percent * 100:g})")
+        elif turns:
+            print(f"(cached P{percent * 100:g} is {turns} turns behind; run refresh-caches to update it)")
+
+
+def session_stats(percents, sort_by=None, limit=None, parquet_dir=None, cached=False):
+    import latency_analytics
+    import stats_cache
+
+    if cached:
+        conn = connect()
+        print_cache_staleness(conn, percents)
+        stats = stats_cache.cached_session_stats(conn, percents)
+        conn.close()
+    else:
+        stats = latency_analytics.session_stats(load_analytics_turns(parquet_dir), percents)
+    if not len(stats):
         print("No sessions found.")
         return
-    if show_percentiles:
-        print(f"{'Session ID':<25} {'First Turn Start':<25} {'Num Turns':<10} {'P50 V2V (s)':<12} {'P95 V2V (s)':<12}")
-        print("-" * 95)
+
+    import numpy as np
+
+    if sort_by == "turns":
+        order = np.argsort(-stats.num_turns, kind="stable")
+    elif sort_by == "interrupted":
+        order = np.argsort(-stats.interruption_rate, kind="stable")
+    elif sort_by == "mean":
+        order = np.argsort(-np.nan_to_num(stats.v2v_mean, nan=-1), kind="stable")
+    elif sort_by:
+        # pNN, slowest first
+        key = stats.v2v_percentiles[float(sort_by[1:]) / 100]
+        order = np.argsort(-np.nan_to_num(key, nan=-1), kind="stable")
     else:
-        print(f"{'Session ID':<25} {'First Turn Start':<25} {'Num Turns':<10}")
-        print("-" * 65)
-    for session_id, first_turn_start, num_turns in sessions:
-        # Format the timestamp to local time, human readable
-        dt = datetime.datetime.fromtimestamp(first_turn_start)
-        formatted_time = dt.strftime("%Y-%m-%d %H:%M:%S")
-        if show_percentiles:
-            # Get all voice_to_voice_response_time values for this session
-            cursor.execute(
-                "SELECT voice_to_voice_response_time FROM conversation_turn WHERE session_id = ? AND voice_to_voice_response_time IS NOT NULL ORDER BY turn_number ASC",
-                (session_id,)
-            )
-            v2v_times = [row[0] for row in cursor.fetchall() if row[0] is not None]
-            v2v_times_sorted = sorted(v2v_times)
-            p50 = percentile(v2v_times_sorted, 0.5)
-            p95 = percentile(v2v_times_sorted, 0.95)
-            p50_str = f"{p50:.3f}" if p50 is not None else "-"
-            p95_str = f"{p95:.3f}" if p95 is not None else "-"
-            print(f"{session_id:<25} {formatted_time:<25} {num_turns:<10} {p50_str:<12} {p95_str:<12}")
+        order = np.argsort(stats.first_turn_start, kind="stable")
+    if limit:
+        order = order[:limit]
+
+    percent_headers = "".join(f"{f'P{p * 100:g} V2V (s)':<14}" for p in percents)
+    print(f"{'Session ID':<25} {'First Turn Start':<21} {'Turns':<7} {'Mean V2V (s)':<14}{percent_headers}{'Interrupted':<11}")
+    print("-" * (83 + 14 * len(percents)))
+    for i in order:
+        percent_values = "".join(f"{format_seconds(stats.v2v_percentiles[p][i]):<14}" for p in percents)
+        print(
+            f"{stats.session_ids[i]:<25} {format_start_time(stats.first_turn_start[i]):<21} {stats.num_turns[i]:<7} "
+            f"{format_seconds(stats.v2v_mean[i]):<14}{percent_values}{stats.interruption_rate[i]:<11.1%}"
+        )
+
+
+def latency_summary(percents, parquet_dir=None):
+    import latency_analytics
+
+    turns = load_analytics_turns(parquet_dir)
+    if not len(turns):
+        print("No turns found.")
+        return
+    summary = latency_analytics.overall_stats(turns, percents)
+    print(f"Sessions: {summary['sessions']}")
+    print(f"Turns: {summary['turns']} ({summary['turns_with_v2v']} with a voice-to-voice time)")
+    print(f"Interruption rate: {summary['interruption_rate']:.1%}")
+    if summary["v2v_mean"] is not None:
+        print(f"Mean V2V: {summary['v2v_mean']:.3f} s")
+    for percent, value in summary["v2v_percentiles"].items():
+        if value is not None:
+            print(f"P{percent * 100:g} V2V (all turns): {value:.3f} s")
+    for percent, value in summary["session_median_percentiles"].items():
+        if value is not None:
+            print(f"P{percent * 100:g} of per-session median V2V: {value:.3f} s")
+
+
+def parse_time(text):
+    """A unix timestamp, a local date/time like 2025-06-08 or 2025-06-08T22:00, or a duration like 24h meaning that long ago."""
+    import latency_histogram
+
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.now().timestamp() - latency_histogram.parse_duration(text)
+    except ValueError:
+        return datetime.datetime.fromisoformat(text).timestamp()
+
+
+def latency_report(bucket, since=None, until=None, percents=(0.5, 0.95, 0.99)):
+    import latency_histogram
+
+    bucket_seconds = latency_histogram.parse_duration(bucket)
+    conn = connect()
+    behind = latency_histogram.behind(conn)
+    if behind:
+        print(f"(the stored histograms are {behind} turns behind; run refresh-caches to update them)")
+    window = latency_histogram.LatencyHistogram()
+    percent_headers = "".join(f"{f'P{p * 100:g} (s)':<10}" for p in percents)
+    print(f"{'Bucket Start':<21} {'Turns':<10}{percent_headers}")
+    print("-" * (32 + 10 * len(percents)))
+    for bucket_start, histogram in latency_histogram.bucketed_histograms(conn, bucket_seconds, since, until):
+        window.merge(histogram)
+        values = "".join(f"{histogram.percentile(p):<10.3f}" for p in percents)
+        print(f"{format_start_time(bucket_start):<21} {histogram.total:<10}{values}")
+    conn.close()
+    if not window.total:
+        print("No turns in this window.")
+        return
+    print("-" * (32 + 10 * len(percents)))
+    values = "".join(f"{window.percentile(p):<10.3f}" for p in percents)
+    print(f"{'All':<21} {window.total:<10}{values}")
+
+
+def fleet_summary(db_paths, percents, top_k=10, workers=None):
+    import latency_histogram
+    import shards
+
+    summaries, merged = shards.fleet_summary(db_paths, top_k, workers)
+    percent_headers = "".join(f"{f'P{p * 100:g} (s)':<10}" for p in percents)
+    print(f"{'DB':<50} {'Sessions':<10} {'Turns':<10}{percent_headers}")
+    print("-" * (72 + 10 * len(percents)))
+    for summary in summaries:
+        histogram = latency_histogram.LatencyHistogram(summary["histogram"])
+        values = "".join(f"{format_seconds(histogram.percentile(p) or float('nan')):<10}" for p in percents)
+        print(f"{summary['db']:<50} {summary['sessions']:<10} {summary['turns']:<10}{values}")
+    print("-" * (72 + 10 * len(percents)))
+    values = "".join(f"{format_seconds(merged['histogram'].percentile(p) or float('nan')):<10}" for p in percents)
+    print(f"{f'All ({len(summaries)} dbs)':<50} {merged['sessions']:<10} {merged['turns']:<10}{values}")
+    if merged["turns"]:
+        print(f"Interruption rate: {merged['interrupted'] / merged['turns']:.1%}")
+    if merged["v2v_count"]:
+        print(f"Mean V2V: {merged['v2v_sum'] / merged['v2v_count']:.3f} s")
+    if merged["slowest"]:
+        print()
+        print(f"Slowest {len(merged['slowest'])} turns:")
+        print(f"{'V2V (s)':<10} {'Session ID':<25} {'Turn':<6} {'Start':<21} DB")
+        for v2v, db_path, session_id, turn_number, turn_start in merged["slowest"]:
+            print(f"{v2v:<10.3f} {session_id:<25} {turn_number:<6} {format_start_time(turn_start):<21} {db_path}")
+
+
+TAIL_SQL = """
+    SELECT id, session_id, turn_number, turn_start_time, voice_to_voice_response_time, interrupted, user_speech_text
+    FROM conversation_turn
+    WHERE id > ?
+"""
+
+
+def tail(session_id=None, slow_than=None, window=100, interval=0.5):
+    # Read-only, so this never takes the write lock, and in WAL mode readers don't block
+    # the bots' commits. Each poll is a PRAGMA data_version, which only changes when
+    # another connection commits. New turns are then read by id from the last one seen.
+    conn = sqlite3.connect(pathlib.Path(DB_PATH).resolve().as_uri() + "?mode=ro", uri=True)
+    sql = TAIL_SQL + (" AND session_id = ?" if session_id else "") + " ORDER BY id"
+    watermark = conn.execute("SELECT COALESCE(MAX(id), 0) FROM conversation_turn").fetchone()[0]
+    data_version = None
+    recent = collections.deque(maxlen=window)
+    print(f"{'Start':<21} {'Session ID':<25} {'Turn':<6} {'V2V (s)':<9} {f'P95 last {window}':<13} User")
+    try:
+        while True:
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if version != data_version:
+                data_version = version
+                params = (watermark, session_id) if session_id else (watermark,)
+                for turn_id, turn_session_id, turn_number, start, v2v, interrupted, user_text in conn.execute(sql, params):
+                    watermark = turn_id
+                    if v2v is not None:
+                        recent.append(v2v)
+                    if slow_than is not None and (v2v is None or v2v < slow_than):
+                        continue
+                    p95 = sorted_percentile(sorted(recent), 0.95)
+                    print(
+                        f"{format_start_time(start):<21} {turn_session_id:<25} {turn_number:<6} "
+                        f"{f'{v2v:.3f}' if v2v is not None else '-':<9} {f'{p95:.3f}' if p95 is not None else '-':<13} "
+                        f"{'(interrupted) ' if interrupted else ''}{(user_text or '')[:60]}",
+                        flush=True,
+                    )
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+
+
+def list_sessions_with_percentiles(conn):
+    # One streaming statement: sessions in first turn start time order, like plain
+    # list-sessions, each joined to its range of the (session_id, v2v) index. A session's
+    # rows arrive together and already sorted by voice-to-voice time, so its percentiles
+    # are computed and printed as soon as its last row goes past. sqlite only sorts
+    # within runs of sessions that share a start time, and only one session's turns are
+    # in memory at a time.
+    cursor = conn.execute(
+        """
+        SELECT s.session_id, s.first_turn_start_time, s.num_turns, t.voice_to_voice_response_time
+        FROM session s
+        LEFT JOIN conversation_turn t INDEXED BY conversation_turn_by_session_v2v
+          ON t.session_id = s.session_id AND t.voice_to_voice_response_time IS NOT NULL
+        ORDER BY s.first_turn_start_time, s.session_id, t.voice_to_voice_response_time
+        """
+    )
+    found = False
+    for (session_id, first_turn_start, num_turns), rows in itertools.groupby(cursor, key=lambda row: row[:3]):
+        if not found:
+            print(f"{'Session ID':<25} {'First Turn Start':<25} {'Num Turns':<10} {'P50 V2V (s)':<12} {'P95 V2V (s)':<12}")
+            print("-" * 95)
+            found = True
+        v2v_times = [row[3] for row in rows if row[3] is not None]
+        p50 = sorted_percentile(v2v_times, 0.5)
+        p95 = sorted_percentile(v2v_times, 0.95)
+        p50_str = f"{p50:.3f}" if p50 is not None else "-"
+        p95_str = f"{p95:.3f}" if p95 is not None else "-"
+        print(f"{session_id:<25} {format_start_time(first_turn_start):<25} {num_turns:<10} {p50_str:<12} {p95_str:<12}")
+    if not found:
+        print("No sessions found.")
+
+
+def list_sessions_with_cached_percentiles(conn):
+    # Read-only: percentiles as of the last refresh-caches, joined onto the session table.
+    print_cache_staleness(conn, (0.5, 0.95))
+    cursor = conn.execute(
+        """
+        SELECT s.session_id, s.first_turn_start_time, s.num_turns, p50.v2v, p95.v2v
+        FROM session s
+        LEFT JOIN session_percentile p50 ON p50.session_id = s.session_id AND p50.percent = 0.5
+        LEFT JOIN session_percentile p95 ON p95.session_id = s.session_id AND p95.percent = 0.95
+        ORDER BY s.first_turn_start_time ASC
+        """
+    )
+    found = False
+    for session_id, first_turn_start, num_turns, p50, p95 in cursor:
+        if not found:
+            print(f"{'Session ID':<25} {'First Turn Start':<25} {'Num Turns':<10} {'P50 V2V (s)':<12} {'P95 V2V (s)':<12}")
+            print("-" * 95)
+            found = True
+        p50_str = f"{p50:.3f}" if p50 is not None else "-"
+        p95_str = f"{p95:.3f}" if p95 is not None else "-"
+        print(f"{session_id:<25} {format_start_time(first_turn_start):<25} {num_turns:<10} {p50_str:<12} {p95_str:<12}")
+    if not found:
+        print("No sessions found.")
+
+
+def refresh_caches(percents):
+    import latency_histogram
+    import stats_cache
+
+    conn = connect()
+    added = latency_histogram.refresh(conn)
+    recomputed = stats_cache.refresh(conn, percents)
+    conn.close()
+    print(f"Added {added} new turns to the stored histograms.")
+    print(f"Recomputed cached percentiles for {recomputed} sessions.")
+
+
+# Each stage's latency is the time from the previous stage's event to its own, so the
+# stages add up to the voice-to-voice time. An LLM request needs both the VAD stop and
+# the final transcript, so the LLM stage is timed from whichever came last.
+STAGE_LATENCY_SQL = """
+    SELECT
+      stt_final_ns - vad_stop_ns,
+      llm_first_token_ns - MAX(vad_stop_ns, COALESCE(stt_final_ns, vad_stop_ns)),
+      tts_first_audio_ns - llm_first_token_ns,
+      first_audio_out_ns - tts_first_audio_ns,
+      first_audio_out_ns - vad_stop_ns
+    FROM turn_stage_timing
+"""
+STAGE_NAMES = ["STT final", "LLM first token", "TTS first audio", "Audio out", "Voice-to-voice"]
+
+
+def format_stage_ms(ns):
+    return f"{ns / 1e6:.0f}" if ns is not None else "-"
+
+
+def stage_latency(session_id=None):
+    conn = connect()
+    cursor = conn.cursor()
+    if session_id:
+        cursor.execute(STAGE_LATENCY_SQL + " WHERE vad_stop_ns IS NOT NULL AND session_id = ?", (session_id,))
+    else:
+        cursor.execute(STAGE_LATENCY_SQL + " WHERE vad_stop_ns IS NOT NULL")
+    rows = cursor.fetchall()
+    conn.close()
+    if not rows:
+        print("No stage timing found.")
+        return
+    print(f"{'Stage':<20} {'Turns':<8} {'P50 (ms)':<10} {'P95 (ms)':<10} {'P99 (ms)':<10}")
+    print("-" * 60)
+    for i, name in enumerate(STAGE_NAMES):
+        values = sorted(row[i] for row in rows if row[i] is not None)
+        p50, p95, p99 = (percentile(values, p) for p in (0.5, 0.95, 0.99))
+        print(f"{name:<20} {len(values):<8} {format_stage_ms(p50):<10} {format_stage_ms(p95):<10} {format_stage_ms(p99):<10}")
+
+
+# Timing metrics are summarized with percentiles, usage metrics with totals.
+TIMING_METRICS = {"ttfb", "processing"}
+
+
+def service_metrics(session_id=None):
+    conn = connect()
+    cursor = conn.cursor()
+    query = "SELECT service, metric, value FROM service_metric"
+    params = ()
+    if session_id:
+        query += " WHERE session_id = ?"
+        params = (session_id,)
+    cursor.execute(query + " ORDER BY service, metric, value", params)
+    print(f"{'Service':<35} {'Metric':<18} {'Count':<8} {'P50':<10} {'P95':<10} {'Total':<12}")
+    print("-" * 95)
+    found = False
+    for (service, metric), rows in itertools.groupby(cursor, key=lambda row: row[:2]):
+        found = True
+        values = [row[2] for row in rows]
+        if metric in TIMING_METRICS:
+            p50 = f"{percentile(values, 0.5):.3f}"
+            p95 = f"{percentile(values, 0.95):.3f}"
+            total = "-"
         else:
-            print(f"{session_id:<25} {formatted_time:<25} {num_turns:<10}")
+            p50 = p95 = "-"
+            total = f"{sum(values):.0f}"
+        print(f"{service:<35} {metric:<18} {len(values):<8} {p50:<10} {p95:<10} {total:<12}")
+    if not found:
+        print("No service metrics found.")
+    conn.close()
+
+
+# snippet() highlight markers. Control characters never appear in transcripts, so a
+# marker in a snippet always means the match is in that column.
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+SEARCH_SQL = f"""
+    SELECT
+      t.session_id, t.turn_number, t.turn_start_time,
+      snippet(conversation_turn_fts, 0, '{MATCH_START}', '{MATCH_END}', '...', 12),
+      snippet(conversation_turn_fts, 1, '{MATCH_START}', '{MATCH_END}', '...', 12)
+    FROM conversation_turn_fts
+    JOIN conversation_turn t ON t.id = conversation_turn_fts.rowid
+    WHERE conversation_turn_fts MATCH ?
+    ORDER BY rank
+    LIMIT ?
+"""
+
+
+def search(query, limit=20):
+    # Best bm25 matches first. The query uses FTS5 syntax (AND, OR, NOT, "a phrase",
+    # prefix*, user_speech_text: ...); anything that isn't valid FTS5 is searched for as
+    # a phrase, so pasting "the bot said X" just works.
+    conn = connect()
+    try:
+        rows = conn.execute(SEARCH_SQL, (query, limit)).fetchall()
+    except sqlite3.OperationalError:
+        # a bad query fails in many ways ("fts5: syntax error", "no such column: said",
+        # "unterminated string"); a real db error just fails again below
+        phrase = '"' + query.replace('"', '""') + '"'
+        rows = conn.execute(SEARCH_SQL, (phrase, limit)).fetchall()
+    conn.close()
+    if not rows:
+        print("No matching turns found.")
+        return
+    for session_id, turn_number, start, user_snippet, llm_snippet in rows:
+        print(f"{session_id} turn {turn_number} ({format_start_time(start)})")
+        # snippet() returns the start of the column when the match is in the other one,
+        # and NULL for a NULL column
+        for label, text in (("User:", user_snippet), ("Bot: ", llm_snippet)):
+            if text and MATCH_START in text:
+                print(f"  {label} {text.replace(MATCH_START, '[').replace(MATCH_END, ']')}")
+
+
+def audio_latency(session_id=None, min_difference=0.25, limit=20):
+    # Compare the frame-timestamp voice-to-voice time with the response gap measured
+    # from the recording by audio_analysis.py.
+    conn = connect()
+    sql = """
+        SELECT t.session_id, t.turn_number, t.voice_to_voice_response_time, a.response_gap_s,
+          a.overlap_s, a.barge_in_s, a.bot_stop_after_barge_in_s
+        FROM turn_audio_timing a
+        JOIN conversation_turn t USING (session_id, turn_number)
+    """
+    rows = conn.execute(sql + (" WHERE session_id = ?" if session_id else ""), (session_id,) if session_id else ()).fetchall()
     conn.close()
+    if not rows:
+        print("No turns have audio measurements. Run audio_analysis.py first.")
+        return
+    pairs = [(row[2], row[3]) for row in rows if row[2] is not None and row[3] is not None]
+    barge_ins = [row[6] for row in rows if row[5] is not None]
+    print(f"Turns measured: {len(rows)} ({len(pairs)} with both a reported and a measured response time)")
+    print(f"{'':<38} {'P50 (s)':<10} {'P95 (s)':<10}")
+    for label, values in (
+        ("Reported V2V (frame timestamps)", [reported for reported, _ in pairs]),
+        ("Measured response gap (audio)", [measured for _, measured in pairs]),
+        ("Measured - reported", [measured - reported for reported, measured in pairs]),
+        ("Overlap per turn", [row[4] for row in rows]),
+        ("Bot talk time after barge-in", barge_ins),
+    ):
+        if values:
+            print(f"{label:<38} {percentile(values, 0.5):<10.3f} {percentile(values, 0.95):<10.3f}")
+    print(f"Turns with a barge-in: {len(barge_ins)}")
+    off = sorted(
+        (row for row in rows if row[2] is not None and row[3] is not None and abs(row[3] - row[2]) >= min_difference),
+        key=lambda row: -abs(row[3] - row[2]),
+    )
+    if off:
+        print()
+        print(f"{len(off)} turns where they differ by at least {min_difference:g}s (largest first):")
+        print(f"{'Session ID':<25} {'Turn':<6} {'Reported (s)':<14} {'Measured (s)':<14}")
+        for row in off[:limit]:
+            print(f"{row[0]:<25} {row[1]:<6} {row[2]:<14.3f} {row[3]:<14.3f}")
 
 
 def show_session(session_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect()
     cursor = conn.cursor()
     cursor.execute(
         """
-        SELECT turn_number, turn_start_time, turn_end_time, user_speech_text, llm_response_text, voice_to_voice_response_time, interrupted
-        FROM conversation_turn
-        WHERE session_id = ?
-        ORDER BY turn_number ASC
+        SELECT
+          t.turn_number, t.turn_start_time, t.turn_end_time, t.user_speech_text, t.llm_response_text,
+          t.voice_to_voice_response_time, t.interrupted,
+          s.stt_final_ns - s.vad_stop_ns,
+          s.llm_first_token_ns - MAX(s.vad_stop_ns, COALESCE(s.stt_final_ns, s.vad_stop_ns)),
+          s.tts_first_audio_ns - s.llm_first_token_ns,
+          s.first_audio_out_ns - s.tts_first_audio_ns,
+          a.response_gap_s, a.barge_in_s
+        FROM conversation_turn t
+        LEFT JOIN turn_stage_timing s USING (session_id, turn_number)
+        LEFT JOIN turn_audio_timing a USING (session_id, turn_number)
+        WHERE t.session_id = ?
+        ORDER BY t.turn_number ASC
         """,
         (session_id,)
     )
@@ -95,7 +562,7 @@ def show_session(session_id):
     print(f"Session: {session_id}")
     print("-" * 80)
     for t in turns:
-        (turn_number, start, end, user_text, llm_text, v2v_time, interrupted) = t
+        (turn_number, start, end, user_text, llm_text, v2v_time, interrupted, *stages, audio_gap, barge_in) = t
         start_fmt = datetime.datetime.fromtimestamp(start).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
         end_fmt = datetime.datetime.fromtimestamp(end).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
         print(f"Turn {turn_number}")
@@ -103,6 +570,13 @@ def show_session(session_id):
         print(f"  End:   {end_fmt}")
         print(f"  Interrupted: {bool(interrupted)}")
         print(f"  Voice-to-voice response time: {v2v_time:.3f} s")
+        if any(stage is not None for stage in stages):
+            breakdown = ", ".join(f"{name} {format_stage_ms(ns)}" for name, ns in zip(STAGE_NAMES, stages))
+            print(f"  Stages (ms): {breakdown}")
+        if audio_gap is not None:
+            print(f"  Response gap measured from the recording: {audio_gap:.3f} s")
+        if barge_in is not None:
+            print(f"  User barged in {barge_in:.3f} s into the bot's speech")
         print(f"  User said: {user_text}")
         print(f"  LLM said:  {llm_text}")
         print("-" * 80)
@@ -110,20 +584,97 @@ def show_session(session_id):
 
 
 def main():
+    global DB_PATH
     parser = argparse.ArgumentParser(description="Analyze conversation turns in the SQLite DB.")
+    parser.add_argument("--db", default=DB_PATH, help="Path to the db, or a glob of per-host dbs for fleet-summary (quote it), e.g. 'hosts/*/conversation_turns.db'.")
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     parser_list = subparsers.add_parser("list-sessions", help="List all session IDs with first turn time and number of turns.")
     parser_list.add_argument("--show-percentiles", action="store_true", help="Show P50 and P95 voice-to-voice response time for each session.")
+    parser_list.add_argument("--cached", action="store_true", help="With --show-percentiles, read percentiles from the cache refresh-caches keeps instead of scanning turns.")
     parser_show = subparsers.add_parser("show-session", help="Show all turns for a session.")
     parser_show.add_argument("session_id", help="Session ID to display.")
+    parser_stages = subparsers.add_parser("stage-latency", help="Show P50/P95/P99 latency of each voice-to-voice stage (STT, LLM, TTS, audio out).")
+    parser_stages.add_argument("--session-id", help="Only include turns from this session.")
+    parser_metrics = subparsers.add_parser("service-metrics", help="Summarize TTFB, processing time (s) and LLM/TTS usage for each service.")
+    parser_metrics.add_argument("--session-id", help="Only include metrics from this session.")
+    parser_session_stats = subparsers.add_parser("session-stats", help="Per-session V2V mean, percentiles and interruption rate, computed for all sessions at once with NumPy.")
+    parser_session_stats.add_argument("--percentiles", default="50,95", help="Comma-separated percentiles to show (default: 50,95).")
+    parser_session_stats.add_argument("--sort-by", help="Sort by 'turns', 'interrupted', 'mean', or a percentile like 'p95' (largest first). Default: first turn start.")
+    parser_session_stats.add_argument("--limit", type=int, help="Only show this many sessions.")
+    parser_session_stats.add_argument("--parquet", metavar="DIR", help="Read turns from a turn_export.py Parquet export instead of the db.")
+    parser_session_stats.add_argument("--cached", action="store_true", help="Read percentiles from the cache refresh-caches keeps instead of scanning turns.")
+    parser_refresh = subparsers.add_parser("refresh-caches", help="Bring the latency-report histograms and cached per-session percentiles up to date. Writes to the db.")
+    parser_refresh.add_argument("--percentiles", default="50,95", help="Comma-separated percentiles to cache (default: 50,95).")
+    parser_summary = subparsers.add_parser("latency-summary", help="Fleet-wide V2V percentiles and interruption rate over every turn.")
+    parser_summary.add_argument("--percentiles", default="50,95,99", help="Comma-separated percentiles to show (default: 50,95,99).")
+    parser_summary.add_argument("--parquet", metavar="DIR", help="Read turns from a turn_export.py Parquet export instead of the db.")
+    parser_search = subparsers.add_parser("search", help="Full-text search of user and bot transcripts, best matches first.")
+    parser_search.add_argument("query", help='FTS5 query, e.g. "weather tomorrow", refund OR cancel, book*, llm_response_text: sorry.')
+    parser_search.add_argument("--limit", type=int, default=20, help="Maximum number of turns to show (default: 20).")
+    parser_fleet = subparsers.add_parser("fleet-summary", help="Merged V2V percentiles, counts and slowest turns across every db matched by --db, one process per db.")
+    parser_fleet.add_argument("--percentiles", default="50,95,99", help="Comma-separated percentiles to show (default: 50,95,99).")
+    parser_fleet.add_argument("--top", type=int, default=10, help="How many of the slowest turns to list (default: 10).")
+    parser_fleet.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    parser_tail = subparsers.add_parser("tail", help="Print turns as they are saved, with a rolling P95 V2V. Read-only; never blocks the bots.")
+    parser_tail.add_argument("--session", help="Only show turns from this session.")
+    parser_tail.add_argument("--slow-than", type=float, help="Only print turns with a V2V time of at least this many seconds (all turns still count toward the P95).")
+    parser_tail.add_argument("--window", type=int, default=100, help="Number of recent turns the rolling P95 covers (default: 100).")
+    parser_tail.add_argument("--interval", type=float, default=0.5, help="Seconds between checks for new turns (default: 0.5).")
+    parser_audio = subparsers.add_parser("audio-latency", help="Compare reported V2V times with response gaps, overlaps and barge-ins measured from the recordings by audio_analysis.py.")
+    parser_audio.add_argument("--session-id", help="Only include turns from this session.")
+    parser_audio.add_argument("--min-difference", type=float, default=0.25, help="List turns where measured and reported times differ by at least this many seconds (default: 0.25).")
+    parser_audio.add_argument("--limit", type=int, default=20, help="Maximum number of those turns to list (default: 20).")
+    parser_report = subparsers.add_parser("latency-report", help="Fleet V2V percentiles per time bucket, from stored mergeable histograms.")
+    parser_report.add_argument("--bucket", default="1h", help="Bucket size, a whole number of minutes/hours/days: 15m, 1h, 1d (default: 1h).")
+    parser_report.add_argument("--since", help="Start of the window: unix time, local ISO date/time, or a duration ago like 24h.")
+    parser_report.add_argument("--until", help="End of the window, same formats as --since.")
+    parser_report.add_argument("--percentiles", default="50,95,99", help="Comma-separated percentiles to show (default: 50,95,99).")
 
     args = parser.parse_args()
 
+    db_paths = sorted(glob.glob(args.db)) if glob.has_magic(args.db) else [args.db]
+    if not db_paths:
+        parser.error(f"No dbs match {args.db}")
+    if args.command == "fleet-summary":
+        fleet_summary(db_paths, parse_percents(args.percentiles), args.top, args.workers)
+        return
+    if len(db_paths) > 1:
+        parser.error(f"{args.command} works on one db, but {args.db} matches {len(db_paths)}; use fleet-summary")
+    DB_PATH = db_paths[0]
+
     if args.command == "list-sessions":
-        list_sessions(show_percentiles=args.show_percentiles)
+        list_sessions(show_percentiles=args.show_percentiles, cached=args.cached)
     elif args.command == "show-session":
         show_session(args.session_id)
+    elif args.command == "stage-latency":
+        stage_latency(args.session_id)
+    elif args.command == "service-metrics":
+        service_metrics(args.session_id)
+    elif args.command == "session-stats":
+        percents = parse_percents(args.percentiles)
+        if args.sort_by and args.sort_by.startswith("p"):
+            percents = sorted(set(percents) | {float(args.sort_by[1:]) / 100})
+        if args.cached and args.parquet:
+            parser.error("--cached and --parquet can't be used together")
+        session_stats(percents, args.sort_by, args.limit, args.parquet, args.cached)
+    elif args.command == "refresh-caches":
+        refresh_caches(parse_percents(args.percentiles))
+    elif args.command == "latency-summary":
+        latency_summary(parse_percents(args.percentiles), args.parquet)
+    elif args.command == "tail":
+        tail(args.session, args.slow_than, args.window, args.interval)
+    elif args.command == "audio-latency":
+        audio_latency(args.session_id, args.min_difference, args.limit)
+    elif args.command == "search":
+        search(args.query, args.limit)
+    elif args.command == "latency-report":
+        latency_report(
+            args.bucket,
+            parse_time(args.since) if args.since else None,
+            parse_time(args.until) if args.until else None,
+            parse_percents(args.percentiles),
+        )
     else:
         parser.print_help()
 
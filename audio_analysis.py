@@ -0,0 +1,257 @@
+"""
+Measure response latency from the recorded audio itself.
+
+    python audio_analysis.py [--db PATH] [--audio-dir DIR] [--workers N] [--force] [session_id ...]
+
+The bot records in stereo, with the user on the left channel and the bot on the right.
+For each recording, this finds the speech on each channel with a simple energy detector:
+the RMS of each 20ms frame, compared with a threshold set from that channel's noise
+floor. Pauses shorter than MIN_SILENCE_S are bridged and blips shorter than MIN_SPEECH_S
+are dropped. Then, for every turn, it measures:
+
+- user_stop_s, bot_start_s: when the user really stopped talking and the bot's voice
+  really started, as seconds into the recording
+- response_gap_s: bot_start_s - user_stop_s. This is the silence the user heard, and it
+  is negative if the bot started talking over them
+- overlap_s: how long both were talking at once during the turn
+- barge_in_s: if the user started talking while the bot was speaking, how far into the
+  bot's speech that was
+- bot_stop_after_barge_in_s: how long the bot kept talking after that
+
+The results go in the turn_audio_timing table, keyed like conversation_turn, so they sit
+next to the frame-timestamp voice_to_voice_response_time
+(`analyze_conversations.py audio-latency` compares them). Recordings are analyzed in a
+process pool. Only the pool's results come back to this process, which writes them all
+in one transaction.
+
+Recordings are read in blocks, so memory use doesn't grow with call length. If the WAV
+has been archived, the .vca archive is read instead. Mono recordings, made before the
+bot recorded in stereo, are skipped.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import migrations
+from recording import AUDIO_DIR, WAV_HEADER_SIZE, parse_wav_header
+from recording_archive import RecordingArchive, archive_path
+
+DB_PATH = os.path.join(os.path.dirname(__file__), "db-and-recordings/conversation_turns.db")
+
+USER_CHANNEL = 0
+BOT_CHANNEL = 1
+
+FRAME_S = 0.02
+# A frame is speech if it is this much louder than the channel's noise floor (the 10th
+# percentile of frame levels), and at least MIN_SPEECH_DBFS. The bot's channel is
+# digital silence between utterances, so its floor comes from MIN_SPEECH_DBFS.
+SPEECH_MARGIN_DB = 12.0
+MIN_SPEECH_DBFS = -45.0
+MIN_SILENCE_S = 0.3
+MIN_SPEECH_S = 0.1
+# The barge-in that ends an interrupted turn is where the next turn starts, so look a
+# little past the end of the turn for it.
+BARGE_IN_SLACK_S = 0.5
+
+BLOCK_FRAMES = 3000  # 60s of 20ms frames
+
+INSERT_AUDIO_TIMING_SQL = "INSERT OR REPLACE INTO turn_audio_timing (session_id, turn_number, user_stop_s, bot_start_s, response_gap_s, overlap_s, barge_in_s, bot_stop_after_barge_in_s) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+def _frame_levels(read_frames, total_frames, num_channels, frame_len):
+    """dBFS of each frame on each channel, shape (frames, channels)."""
+    levels = []
+    block = BLOCK_FRAMES * frame_len
+    for start in range(0, total_frames - frame_len + 1, block):
+        audio = read_frames(start, min(start + block, total_frames))
+        frames = len(audio) // (frame_len * num_channels)
+        x = audio[: frames * frame_len * num_channels].reshape(frames, frame_len, num_channels).astype(np.float32)
+        rms = np.sqrt(np.mean(x * x, axis=1)) / 32768.0
+        levels.append(20 * np.log10(rms + 1e-10))
+    if not levels:
+        return np.zeros((0, num_channels), dtype=np.float32)
+    return np.concatenate(levels)
+
+
+def speech_segments(levels):
+    """[(start_s, end_s)] of speech, from one channel's frame levels."""
+    if len(levels) == 0:
+        return []
+    threshold = max(np.percentile(levels, 10) + SPEECH_MARGIN_DB, MIN_SPEECH_DBFS)
+    active = np.r_[0, (levels > threshold).astype(np.int8), 0]
+    edges = np.diff(active)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    segments = []
+    for start, end in zip(starts * FRAME_S, ends * FRAME_S):
+        if segments and start - segments[-1][1] < MIN_SILENCE_S:
+            segments[-1][1] = end
+        else:
+            segments.append([start, end])
+    return [(start, end) for start, end in segments if end - start >= MIN_SPEECH_S]
+
+
+def measure_turn(user, bot, start_s, end_s):
+    """The turn_audio_timing values for the turn at [start_s, end_s) of the recording."""
+    # only the speech near this turn matters
+    user = [(u_start, u_end) for u_start, u_end in user if u_end > start_s and u_start < end_s + BARGE_IN_SLACK_S]
+    bot = [(b_start, b_end) for b_start, b_end in bot if b_end > start_s and b_start < end_s + BARGE_IN_SLACK_S]
+    bot_start = next((b_start for b_start, _ in bot if start_s <= b_start < end_s), None)
+    user_stop = None
+    if bot_start is not None:
+        # the user's speech that the bot is answering: it may have started a little
+        # before the VAD noticed it, which is where the turn starts
+        user_stop = max((u_end for u_start, u_end in user if u_start < bot_start), default=None)
+    overlap = 0.0
+    for u_start, u_end in user:
+        for b_start, b_end in bot:
+            overlap += max(0.0, min(u_end, b_end, end_s) - max(u_start, b_start, start_s))
+    barge_in = bot_stop_after = None
+    if bot_start is not None:
+        for u_start, _ in user:
+            if not bot_start < u_start < end_s + BARGE_IN_SLACK_S:
+                continue
+            talking_over = next((b_end for b_start, b_end in bot if b_start <= u_start < b_end), None)
+            if talking_over is not None:
+                barge_in = u_start - bot_start
+                bot_stop_after = talking_over - u_start
+                break
+    return (
+        user_stop,
+        bot_start,
+        bot_start - user_stop if user_stop is not None else None,
+        overlap,
+        barge_in,
+        bot_stop_after,
+    )
+
+
+def _open_recording(audio_path):
+    """(read_frames(start, end) -> int16 array of (frames * channels), total_frames, channels, rate, close)."""
+    if audio_path.endswith(".wav"):
+        with open(audio_path, "rb") as f:
+            _, num_channels, sample_rate, block_align, data_size = parse_wav_header(
+                f.read(WAV_HEADER_SIZE), audio_path
+            )
+        if not data_size:
+            raise ValueError(f"{audio_path} was not closed; run `python recording.py repair` first")
+        total_frames = data_size // block_align
+        samples = np.memmap(
+            audio_path, dtype="<i2", mode="r", offset=WAV_HEADER_SIZE, shape=(total_frames * num_channels,)
+        )
+        return (
+            lambda start, end: samples[start * num_channels : end * num_channels],
+            total_frames,
+            num_channels,
+            sample_rate,
+            lambda: None,
+        )
+    archive = RecordingArchive(audio_path)
+    return (
+        lambda start, end: np.frombuffer(archive.read_frames(start, end), dtype="<i2"),
+        archive.total_frames,
+        archive.num_channels,
+        archive.sample_rate,
+        archive.close,
+    )
+
+
+def analyze_recording(audio_path, turns):
+    """
+    Measure each of `turns`, [(turn_number, start_sample, end_sample, sample_rate)], in
+    one recording. Returns [(turn_number, *measurements)], or None for a mono recording.
+    """
+    read_frames, total_frames, num_channels, file_rate, close = _open_recording(audio_path)
+    try:
+        if num_channels != 2:
+            return None
+        levels = _frame_levels(read_frames, total_frames, num_channels, int(file_rate * FRAME_S))
+    finally:
+        close()
+    user = speech_segments(levels[:, USER_CHANNEL])
+    bot = speech_segments(levels[:, BOT_CHANNEL])
+    return [
+        (turn_number, *measure_turn(user, bot, start_sample / sample_rate, end_sample / sample_rate))
+        for turn_number, start_sample, end_sample, sample_rate in turns
+    ]
+
+
+def recording_path(audio_dir, session_id):
+    wav_path = os.path.join(audio_dir, f"conversation-{session_id}.wav")
+    if os.path.exists(wav_path):
+        return wav_path
+    if os.path.exists(archive_path(wav_path)):
+        return archive_path(wav_path)
+    return None
+
+
+def pending_sessions(conn, audio_dir, session_ids=None, force=False):
+    """{session_id: (recording path, turns)} for sessions with turns to analyze."""
+    sql = """
+        SELECT session_id, turn_number, audio_start_sample, audio_end_sample, audio_sample_rate
+        FROM conversation_turn t
+        WHERE audio_start_sample IS NOT NULL
+    """
+    params = []
+    if not force:
+        sql += " AND NOT EXISTS (SELECT 1 FROM turn_audio_timing a WHERE a.session_id = t.session_id AND a.turn_number = t.turn_number)"
+    if session_ids:
+        sql += f" AND session_id IN ({', '.join('?' * len(session_ids))})"
+        params.extend(session_ids)
+    sessions = {}
+    for session_id, *turn in conn.execute(sql + " ORDER BY session_id, turn_number", params):
+        if session_id not in sessions:
+            sessions[session_id] = (recording_path(audio_dir, session_id), [])
+        sessions[session_id][1].append(tuple(turn))
+    return {session_id: value for session_id, value in sessions.items() if value[0] is not None}
+
+
+def analyze_all(conn, audio_dir=AUDIO_DIR, session_ids=None, force=False, workers=None):
+    """Analyze pending sessions in a process pool and store the results. Returns (sessions, turns) stored."""
+    sessions = pending_sessions(conn, audio_dir, session_ids, force)
+    ids = list(sessions)
+    stored_sessions = stored_turns = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(analyze_recording, *sessions[session_id]) for session_id in ids]
+        rows = []
+        for session_id, future in zip(ids, futures):
+            try:
+                results = future.result()
+            except Exception as e:
+                # a truncated or unreadable recording shouldn't cost the rest of the run
+                print(f"Skipping {session_id}: {e!r}", file=sys.stderr)
+                continue
+            if results is None:
+                print(f"Skipping {session_id}: mono recording", file=sys.stderr)
+                continue
+            rows.extend((session_id, *result) for result in results)
+            stored_sessions += 1
+            stored_turns += len(results)
+    with conn:
+        conn.executemany(INSERT_AUDIO_TIMING_SQL, rows)
+    return stored_sessions, stored_turns
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure response gaps, overlaps and barge-ins from stereo recordings.")
+    parser.add_argument("session_ids", nargs="*", help="Sessions to analyze. Defaults to every session with turns that haven't been analyzed.")
+    parser.add_argument("--db", default=DB_PATH, help=f"Conversation db (default: {DB_PATH}).")
+    parser.add_argument("--audio-dir", default=AUDIO_DIR, help=f"Where the recordings are (default: {AUDIO_DIR}).")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    parser.add_argument("--force", action="store_true", help="Re-analyze turns that already have results.")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    migrations.migrate(conn)
+    sessions, turns = analyze_all(conn, args.audio_dir, args.session_ids, args.force, args.workers)
+    conn.close()
+    print(f"Analyzed {turns} turns in {sessions} recordings.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Benchmark for the judge tooling, offline: check_first_turn_greeting.py's request path
+run against a judge_replay.py stand-in, with injected latency and errors.
+
+- wall time, requests and retries at several concurrency limits, every turn sent to
+  the judge
+- the response cache: a cold run and a warm rerun over the same turns
+- the local checks in front of the judge
+
+First turns are synthetic: mostly the greeting with punctuation differences, some with
+extra words, and some unrelated text. The stand-in answers every request with the
+--reply text, so no recordings are needed.
+
+Run from the repo root:
+
+    python -m benchmarks.judge [--turns 500] [--concurrency 1,8,32] [--latency-ms 200]
+
+Prints one JSON object, so results can be saved and compared between runs.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+
+import uvicorn
+
+import check_first_turn_greeting
+import migrations
+from benchmarks.synthetic import random_text
+from judge_client import JudgeCache, JudgeClient
+from judge_replay import create_app
+
+GREETINGS = [
+    "I am here and ready to help!",
+    "I'm here and ready to help.",
+    "I am here and ready to help",
+    "I'm here, and ready to help!",
+]
+
+
+def synthetic_first_turns(num_turns, seed=0):
+    rng = random.Random(seed)
+    turns = []
+    for i in range(num_turns):
+        roll = rng.random()
+        if roll < 0.8:
+            text = rng.choice(GREETINGS)
+        elif roll < 0.9:
+            text = rng.choice(GREETINGS) + " " + random_text(rng, rng.randint(3, 10))
+        else:
+            text = random_text(rng, rng.randint(4, 12))
+        turns.append((f"bench-{i}", text))
+    return turns
+
+
+@contextlib.contextmanager
+def replay_server(**options):
+    """Run a judge_replay.py stand-in on a free local port. Yields its base URL."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(
+        uvicorn.Config(create_app({}, **options), host="127.0.0.1", port=port, log_level="error")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}/v1"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+async def judge_all(turns, base_url, concurrency, cache=None, llm_only=True):
+    client = JudgeClient(
+        api_key="unused",
+        base_url=base_url,
+        concurrency=concurrency,
+        requests_per_minute=1e9,
+    )
+    local = None if llm_only else check_first_turn_greeting.FUZZY_REJECT
+    errors = 0
+    start = time.perf_counter()
+    try:
+        async for _, _, result in check_first_turn_greeting.judge_in_order(
+            turns, client, cache, concurrency * 4, local
+        ):
+            if isinstance(result, Exception):
+                errors += 1
+    finally:
+        await client.close()
+        if cache is not None:
+            cache.flush()
+    seconds = time.perf_counter() - start
+    return {
+        "wall_seconds": seconds,
+        "turns_per_second": len(turns) / seconds,
+        "requests": client.requests,
+        "retries": client.retries,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the judge tooling against a local stand-in.")
+    parser.add_argument("--turns", type=int, default=500)
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency limits.")
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--reply", default="EXACT")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    turns = synthetic_first_turns(args.turns, args.seed)
+    concurrencies = [int(c) for c in args.concurrency.split(",")]
+    options = dict(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        retry_after=0.1,
+        fallback=args.reply,
+        seed=args.seed,
+    )
+    result = {
+        "benchmark": "judge",
+        "turns": args.turns,
+        "distinct_texts": len({text for _, text in turns}),
+        "server": {key: value for key, value in options.items() if key != "fallback"},
+    }
+
+    with replay_server(**options) as base_url:
+        result["concurrency"] = {
+            str(concurrency): asyncio.run(judge_all(turns, base_url, concurrency))
+            for concurrency in concurrencies
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = sqlite3.connect(os.path.join(tmp, "judge.db"))
+            migrations.migrate(conn)
+            cache = JudgeCache(conn)
+            cold = asyncio.run(judge_all(turns, base_url, max(concurrencies), cache))
+            warm = asyncio.run(judge_all(turns, base_url, max(concurrencies), cache))
+            conn.close()
+        result["cache"] = {
+            "cold": cold,
+            "warm": warm,
+            "hits": cache.hits,
+            "deduplicated": cache.deduplicated,
+            "misses": cache.misses,
+        }
+        result["local_checks"] = asyncio.run(
+            judge_all(turns, base_url, max(concurrencies), llm_only=False)
+        )
+
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
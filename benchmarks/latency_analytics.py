@@ -0,0 +1,99 @@
+"""
+Benchmark latency_analytics.session_stats() against the per-session loop it replaces:
+one SELECT per session, then analyze_conversations.percentile() for each percentile.
+
+Run from the repo root:
+
+    python -m benchmarks.latency_analytics [--sessions 20000]
+
+Prints one JSON object.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+import latency_analytics
+from analyze_conversations import percentile
+from benchmarks.synthetic import create_turn_db
+
+PERCENTS = (0.5, 0.95, 0.99)
+
+
+def per_session_loop(conn):
+    results = {}
+    session_ids = [row[0] for row in conn.execute("SELECT session_id FROM session")]
+    for session_id in session_ids:
+        rows = conn.execute(
+            "SELECT voice_to_voice_response_time, interrupted FROM conversation_turn WHERE session_id = ?",
+            (session_id,),
+        ).fetchall()
+        v2v = [row[0] for row in rows if row[0] is not None]
+        results[session_id] = (
+            [percentile(v2v, p) for p in PERCENTS],
+            sum(v2v) / len(v2v) if v2v else None,
+            sum(row[1] for row in rows) / len(rows),
+        )
+    return results
+
+
+def vectorized(conn):
+    turns = latency_analytics.load_turns(conn)
+    loaded = time.perf_counter()
+    stats = latency_analytics.session_stats(turns, PERCENTS)
+    return stats, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark grouped latency analytics.")
+    parser.add_argument("--sessions", type=int, default=20000)
+    parser.add_argument("--max-turns", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "conversation_turns.db")
+        num_turns = create_turn_db(db_path, args.sessions, args.max_turns)
+        conn = sqlite3.connect(db_path)
+
+        start = time.perf_counter()
+        loop_results = per_session_loop(conn)
+        loop_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        stats, loaded = vectorized(conn)
+        end = time.perf_counter()
+        conn.close()
+
+    # spot check that both give the same answer
+    index = {session_id: i for i, session_id in enumerate(stats.session_ids)}
+    mismatches = 0
+    for session_id, (percentiles, _, _) in loop_results.items():
+        for percent, expected in zip(PERCENTS, percentiles):
+            got = stats.v2v_percentiles[percent][index[session_id]]
+            if expected is not None and abs(got - expected) > 1e-9:
+                mismatches += 1
+
+    print(
+        json.dumps(
+            {
+                "benchmark": "latency_analytics",
+                "sessions": args.sessions,
+                "turns": num_turns,
+                "percentiles": PERCENTS,
+                "per_session_loop_seconds": loop_seconds,
+                "vectorized_seconds": end - start,
+                "vectorized_load_seconds": loaded - start,
+                "vectorized_compute_seconds": end - loaded,
+                "speedup": loop_seconds / (end - start),
+                "mismatches": mismatches,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
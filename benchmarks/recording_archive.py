@@ -0,0 +1,137 @@
+"""
+Benchmark for recording_archive.py: encode throughput through the process pool, the
+compression ratio, and random-access latency for turn-sized reads (archive vs. WAV).
+
+Run from the repo root:
+
+    python -m benchmarks.recording_archive [--files 8] [--minutes 10] [--workers N]
+
+Prints one JSON object, so results can be saved and compared between runs.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+from recording_archive import RecordingArchive, archive_path, encode_all
+
+SAMPLE_RATE = 24000
+
+
+def synthetic_conversation(seconds, sample_rate=SAMPLE_RATE, seed=0):
+    """Speech-like mono audio: bursts of harmonic tones with noise, separated by silence."""
+    rng = np.random.default_rng(seed)
+    audio = np.zeros(int(seconds * sample_rate), dtype=np.float32)
+    position = 0
+    while position < len(audio):
+        burst = int(rng.uniform(0.5, 4.0) * sample_rate)
+        t = np.arange(burst) / sample_rate
+        pitch = rng.uniform(90, 250)
+        tone = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 6))
+        envelope = np.abs(np.sin(2 * np.pi * rng.uniform(2, 6) * t))
+        segment = 0.2 * tone * envelope + 0.01 * rng.standard_normal(burst)
+        end = min(position + burst, len(audio))
+        audio[position:end] = segment[: end - position]
+        position = end + int(rng.uniform(0.3, 2.0) * sample_rate)
+    return (np.clip(audio, -1, 1) * 32767).astype("<i2").tobytes()
+
+
+def write_wav(path, pcm, sample_rate=SAMPLE_RATE):
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm)
+
+
+def read_wav_frames(path, start_frame, end_frame):
+    with wave.open(path, "rb") as wf:
+        wf.setpos(start_frame)
+        return wf.readframes(end_frame - start_frame)
+
+
+def percentiles_ms(samples):
+    samples = sorted(samples)
+    return {
+        "p50_ms": 1000 * samples[len(samples) // 2],
+        "p95_ms": 1000 * samples[int(len(samples) * 0.95)],
+        "mean_ms": 1000 * statistics.fmean(samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark recording archives.")
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--minutes", type=float, default=10.0, help="Length of each recording.")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--reads", type=int, default=200, help="Random turn reads to time.")
+    parser.add_argument("--turn-seconds", type=float, default=8.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        wav_paths = []
+        for i in range(args.files):
+            path = os.path.join(tmp, f"conversation-bench-{i}.wav")
+            write_wav(path, synthetic_conversation(args.minutes * 60, seed=i))
+            wav_paths.append(path)
+
+        start = time.perf_counter()
+        results = list(encode_all(wav_paths, args.workers))
+        encode_seconds = time.perf_counter() - start
+        audio_seconds = sum(r["audio_seconds"] for r in results)
+        wav_bytes = sum(r["wav_bytes"] for r in results)
+        archive_bytes = sum(r["archive_bytes"] for r in results)
+
+        rng = random.Random(0)
+        turn_frames = int(args.turn_seconds * SAMPLE_RATE)
+        total_frames = int(args.minutes * 60 * SAMPLE_RATE)
+        archive_latencies = []
+        wav_latencies = []
+        for _ in range(args.reads):
+            path = rng.choice(wav_paths)
+            start_frame = rng.randrange(0, max(1, total_frames - turn_frames))
+            end_frame = start_frame + turn_frames
+
+            t0 = time.perf_counter()
+            with RecordingArchive(archive_path(path)) as archive:
+                archive.read_frames(start_frame, end_frame)
+            archive_latencies.append(time.perf_counter() - t0)
+
+            t0 = time.perf_counter()
+            read_wav_frames(path, start_frame, end_frame)
+            wav_latencies.append(time.perf_counter() - t0)
+
+    print(
+        json.dumps(
+            {
+                "benchmark": "recording_archive",
+                "files": args.files,
+                "minutes_per_file": args.minutes,
+                "workers": args.workers or os.cpu_count(),
+                "encode": {
+                    "wall_seconds": encode_seconds,
+                    "audio_seconds_per_second": audio_seconds / encode_seconds,
+                    "wav_mb_per_second": wav_bytes / 1e6 / encode_seconds,
+                    "compression_ratio": archive_bytes / wav_bytes,
+                },
+                "random_access": {
+                    "turn_seconds": args.turn_seconds,
+                    "reads": args.reads,
+                    "archive": percentiles_ms(archive_latencies),
+                    "wav": percentiles_ms(wav_latencies),
+                },
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+Benchmarks for the turn db write path and the analysis scripts, on synthetic data.
+
+- insert throughput with N concurrent writers, for two write paths: a connection per
+  session that commits every turn (how the bot used to save turns), and every session
+  sharing one TurnStore
+- list-sessions and show-session latency in analyze_conversations.py
+- play_turn_audio.py segment lookup: finding the turn's offsets in the db, then reading
+  its frames from the session's WAV
+
+Run from the repo root:
+
+    python -m benchmarks.storage [--sessions 20000] [--writers 1,8,32] [--wav-sessions 20]
+
+Prints one JSON object, so results can be saved and compared between runs.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import analyze_conversations
+import migrations
+import play_turn_audio
+from benchmarks.recording_archive import percentiles_ms
+from benchmarks.synthetic import create_recordings, create_turn_db, synthetic_turns
+from recording import read_turn_audio
+from turn_store import INSERT_TURN_SQL, TurnStore
+
+
+def split_by_session(rows, num_writers):
+    """Deal whole sessions out to the writers, round robin."""
+    writers = [[] for _ in range(num_writers)]
+    session_index = -1
+    last_session = None
+    for row in rows:
+        if row[0] != last_session:
+            last_session = row[0]
+            session_index += 1
+        writers[session_index % num_writers].append(row)
+    return writers
+
+
+def insert_per_session_connections(db_path, rows, num_writers):
+    """Each writer thread has its own connection and commits every turn. Returns seconds."""
+    work = split_by_session(rows, num_writers)
+
+    def write(writer_rows):
+        conn = sqlite3.connect(db_path, timeout=30)
+        for row in writer_rows:
+            conn.execute(INSERT_TURN_SQL, row)
+            conn.commit()
+        conn.close()
+
+    threads = [threading.Thread(target=write, args=(writer_rows,)) for writer_rows in work]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def insert_turn_store(db_path, rows, num_writers):
+    """Each writer is an asyncio task enqueueing into one shared TurnStore. Returns (seconds, stats)."""
+    work = split_by_session(rows, num_writers)
+
+    async def run():
+        store = TurnStore(db_path)
+
+        async def write(writer_id, writer_rows):
+            store.register_session(writer_id)
+            for row in writer_rows:
+                await store.enqueue(INSERT_TURN_SQL, row)
+                # give the other sessions a turn, like a real pipeline would
+                await asyncio.sleep(0)
+            # waits until everything queued so far is committed
+            await store.unregister_session(writer_id)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(write(f"writer-{i}", writer_rows) for i, writer_rows in enumerate(work)))
+        seconds = time.perf_counter() - start
+        stats = store.stats()
+        await store.close()
+        return seconds, stats
+
+    return asyncio.run(run())
+
+
+def fresh_db(path):
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn)
+    conn.close()
+
+
+def insert_benchmarks(tmp, writer_counts, num_sessions):
+    rows = list(synthetic_turns(num_sessions, seed=1))
+    results = []
+    for num_writers in writer_counts:
+        for name in ("per_session_connections", "turn_store"):
+            db_path = os.path.join(tmp, f"insert-{name}-{num_writers}.db")
+            fresh_db(db_path)
+            if name == "turn_store":
+                seconds, stats = insert_turn_store(db_path, rows, num_writers)
+                extra = {"commits": stats["commits"], "max_commit_ms": stats["max_commit_ms"]}
+            else:
+                seconds = insert_per_session_connections(db_path, rows, num_writers)
+                extra = {}
+            conn = sqlite3.connect(db_path)
+            written = conn.execute("SELECT COUNT(*) FROM conversation_turn").fetchone()[0]
+            conn.close()
+            results.append(
+                {
+                    "path": name,
+                    "writers": num_writers,
+                    "turns": written,
+                    "seconds": seconds,
+                    "turns_per_second": written / seconds,
+                    **extra,
+                }
+            )
+    return results
+
+
+def time_calls(fn, args_list):
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for args in args_list:
+            start = time.perf_counter()
+            fn(*args)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def analyzer_benchmarks(db_path, repeats, rng):
+    analyze_conversations.DB_PATH = db_path
+    conn = sqlite3.connect(db_path)
+    session_ids = [row[0] for row in conn.execute("SELECT session_id FROM session")]
+    conn.close()
+    # the first refresh-caches computes the percentile cache for every session, so
+    # report it on its own; --cached listings then only read it
+    cold = time_calls(analyze_conversations.refresh_caches, [([0.5, 0.95],)])[0]
+    return {
+        "list_sessions": percentiles_ms(time_calls(analyze_conversations.list_sessions, [(False,)] * repeats)),
+        "list_sessions_percentiles": percentiles_ms(
+            time_calls(analyze_conversations.list_sessions, [(True,)] * repeats)
+        ),
+        "refresh_caches_first_run_ms": 1000 * cold,
+        "list_sessions_percentiles_cached": percentiles_ms(
+            time_calls(analyze_conversations.list_sessions, [(True, True)] * repeats)
+        ),
+        "show_session": percentiles_ms(
+            time_calls(
+                analyze_conversations.show_session,
+                [(rng.choice(session_ids),) for _ in range(repeats * 20)],
+            )
+        ),
+    }
+
+
+def lookup_benchmarks(db_path, audio_dir, session_ids, lookups, rng):
+    """Everything play_turn_audio.py does for a turn except sending it to the speakers."""
+    play_turn_audio.DB_PATH = db_path
+    conn = sqlite3.connect(db_path)
+    turns = conn.execute(
+        f"SELECT session_id, turn_number FROM conversation_turn WHERE session_id IN ({', '.join('?' * len(session_ids))})",
+        session_ids,
+    ).fetchall()
+    conn.close()
+    samples = []
+    audio_bytes = 0
+    for _ in range(lookups):
+        session_id, turn_number = rng.choice(turns)
+        start = time.perf_counter()
+        start_sec, end_sec = play_turn_audio.get_turn_times(session_id, turn_number)
+        data, _, _ = read_turn_audio(
+            os.path.join(audio_dir, f"conversation-{session_id}.wav"),
+            int(start_sec * 1000),
+            int(end_sec * 1000),
+            1000,
+        )
+        audio_bytes += len(data)
+        samples.append(time.perf_counter() - start)
+    return {"lookups": lookups, "audio_bytes": audio_bytes, **percentiles_ms(samples)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark turn storage and the analysis scripts.")
+    parser.add_argument("--sessions", type=int, default=20000, help="Sessions in the db used for the read benchmarks.")
+    parser.add_argument("--max-turns", type=int, default=8)
+    parser.add_argument("--text-words", type=int, default=12, help="Upper bound on words per user utterance.")
+    parser.add_argument("--insert-sessions", type=int, default=2000, help="Sessions written by each insert benchmark.")
+    parser.add_argument("--writers", default="1,8,32", help="Comma-separated concurrent writer counts.")
+    parser.add_argument("--wav-sessions", type=int, default=20, help="Sessions to write recordings for.")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        insert = insert_benchmarks(
+            tmp, [int(n) for n in args.writers.split(",")], args.insert_sessions
+        )
+
+        db_path = os.path.join(tmp, "conversation_turns.db")
+        audio_dir = os.path.join(tmp, "recordings")
+        start = time.perf_counter()
+        num_turns = create_turn_db(db_path, args.sessions, args.max_turns, args.text_words, args.seed)
+        recorded = create_recordings(db_path, audio_dir, args.wav_sessions)
+        generate_seconds = time.perf_counter() - start
+
+        analyzer = analyzer_benchmarks(db_path, args.repeats, rng)
+        lookup = lookup_benchmarks(db_path, audio_dir, recorded, args.lookups, rng)
+
+    print(
+        json.dumps(
+            {
+                "benchmark": "storage",
+                "sessions": args.sessions,
+                "turns": num_turns,
+                "wav_sessions": len(recorded),
+                "generate_seconds": generate_seconds,
+                "insert": insert,
+                "analyzer": analyzer,
+                "play_turn_audio_lookup": lookup,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Synthetic conversation data for the benchmarks.
+
+Turns look like the ones the bot writes: sessions start a few seconds apart, each has a
+handful of turns, voice-to-voice times are log-normal around 0.8s with a slow tail, and
+about one turn in ten is interrupted.
+"""
+
+import math
+import os
+import random
+import sqlite3
+
+import migrations
+from turn_store import INSERT_TURN_SQL
+
+WORDS = (
+    "the a to and you it is that of I for on what can this we how help ready here "
+    "game play tell me about weather time please thanks okay sure great really"
+).split()
+
+START_TIME = 1749447300.0
+
+
+def random_text(rng, num_words):
+    return " ".join(rng.choice(WORDS) for _ in range(num_words)).capitalize() + "."
+
+
+def v2v_time(rng):
+    # log-normal body with an occasional slow outlier
+    value = math.exp(rng.gauss(math.log(0.8), 0.25))
+    if rng.random() < 0.03:
+        value += rng.uniform(1.0, 3.0)
+    return value
+
+
+def synthetic_turns(num_sessions, max_turns=8, text_words=12, seed=0, start_time=START_TIME):
+    """
+    Yield conversation_turn rows in turn_store.INSERT_TURN_SQL order, the same rows the
+    bot writes, session by session. There are no audio offsets; create_recordings() adds
+    them.
+    """
+    rng = random.Random(seed)
+    session_start = start_time
+    for _ in range(num_sessions):
+        session_start += rng.uniform(1, 30)
+        session_id = f"{int(session_start)}-{rng.randint(0, 1000)}"
+        turn_start = session_start
+        for turn_number in range(1, rng.randint(1, max_turns) + 1):
+            duration = rng.uniform(2, 12)
+            v2v = v2v_time(rng) if turn_number > 1 else rng.uniform(0.3, 0.6)
+            yield (
+                session_id,
+                turn_number,
+                turn_start,
+                turn_start + duration,
+                "" if turn_number == 1 else random_text(rng, rng.randint(1, text_words)),
+                "I am here and ready to help!" if turn_number == 1 else random_text(rng, rng.randint(3, text_words * 2)),
+                v2v,
+                rng.random() < 0.1,
+                None,
+                None,
+                None,
+            )
+            turn_start += duration + rng.uniform(0.2, 3)
+
+
+def create_turn_db(path, num_sessions, max_turns=8, text_words=12, seed=0):
+    """Create (or add to) a migrated db at `path` filled with synthetic turns."""
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn)
+    with conn:
+        conn.executemany(
+            INSERT_TURN_SQL, synthetic_turns(num_sessions, max_turns, text_words, seed)
+        )
+    count = conn.execute("SELECT COUNT(*) FROM conversation_turn").fetchone()[0]
+    conn.close()
+    return count
+
+
+def create_recordings(db_path, audio_dir, num_sessions, sample_rate=24000):
+    """
+    Write a synthetic conversation WAV for each of the first `num_sessions` sessions in
+    the db, named the way the bot names them, and store each turn's sample offsets into
+    it. Returns the session IDs that have a recording.
+    """
+    from benchmarks.recording_archive import synthetic_conversation, write_wav
+
+    conn = sqlite3.connect(db_path)
+    sessions = conn.execute(
+        """
+        SELECT session.session_id, first_turn_start_time, MAX(turn_end_time)
+        FROM session JOIN conversation_turn USING (session_id)
+        GROUP BY session.session_id
+        ORDER BY first_turn_start_time
+        LIMIT ?
+        """,
+        (num_sessions,),
+    ).fetchall()
+    os.makedirs(audio_dir, exist_ok=True)
+    with conn:
+        for i, (session_id, session_start, session_end) in enumerate(sessions):
+            write_wav(
+                os.path.join(audio_dir, f"conversation-{session_id}.wav"),
+                synthetic_conversation(session_end - session_start + 1, sample_rate, seed=i),
+                sample_rate,
+            )
+            conn.execute(
+                """
+                UPDATE conversation_turn SET
+                  audio_start_sample = CAST((turn_start_time - ?) * ? AS INTEGER),
+                  audio_end_sample = CAST((turn_end_time - ?) * ? AS INTEGER),
+                  audio_sample_rate = ?
+                WHERE session_id = ?
+                """,
+                (session_start, sample_rate, session_start, sample_rate, sample_rate, session_id),
+            )
+    conn.close()
+    return [session[0] for session in sessions]
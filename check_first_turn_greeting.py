@@ -1,14 +1,37 @@
+import asyncio
+import collections
+import difflib
+import hashlib
+import json
 import os
+import re
+import time
 import sqlite3
 import openai
 import argparse
 from tqdm import tqdm
 from dotenv import load_dotenv
 
+import analyze_conversations
+import migrations
+from judge_client import JudgeCache, JudgeClient, JudgeRecorder
+
 DB_PATH = os.path.join(
     os.path.dirname(__file__), "db-and-recordings/conversation_turns.db"
 )
 
+EVAL_NAME = "first_turn_greeting"
+MODEL = "gpt-4o"
+TEMPERATURE = 0
+MAX_TOKENS = 3
+
+GREETING = "I am here and ready to help"
+# Local similarity (0-1) below which a text clearly isn't the greeting. Only an exact
+# word-for-word match passes locally; every other near miss goes to the LLM, since one
+# changed word ("not", "kelp") can change the meaning without changing the similarity much.
+FUZZY_REJECT = 0.6
+
+SYSTEM_PROMPT = "You are a strict text checker."
 PROMPT_TEMPLATE = """You are checking LLM output for a voice conversation. The following is the transcript of the first turn of a conversation. If the text is 'I am here and ready to help', respond ONLY with 'EXACT'. You can ignore punctuation and spacing differences. But there should be no other text before or after the phrase, and the phrase should be very close to 'I am here and ready to help'. If it is anything else, respond ONLY with 'NOT EXACT'.
     
     TEXT: 
@@ -16,31 +39,415 @@ PROMPT_TEMPLATE = """You are checking LLM output for a voice conversation. The f
     {text}"""
 
 
-def get_first_turns(conn):
+def prompt_hash(local=FUZZY_REJECT):
+    """
+    A short hash of everything that decides a verdict: the prompt, and the local checks
+    in front of it (`local` is the reject threshold, or None for --llm-only). Runs with
+    different hashes aren't comparable, so --since last only follows a matching one.
+    """
+    settings = [SYSTEM_PROMPT, PROMPT_TEMPLATE]
+    if local is not None:
+        settings += [GREETING, local]
+    return hashlib.sha256(json.dumps(settings).encode()).hexdigest()[:16]
+
+
+def get_first_turns(conn, where="", params=()):
     cursor = conn.cursor()
     cursor.execute(
-        """
+        f"""
         SELECT session_id, llm_response_text
         FROM conversation_turn
-        WHERE turn_number = 1
+        WHERE turn_number = 1 {where}
         ORDER BY session_id ASC
-        """
+        """,
+        params,
     )
     return cursor.fetchall()
 
 
-def check_with_gpt4o(text, openai_api_key):
-    client = openai.OpenAI(api_key=openai_api_key)
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "You are a strict text checker."},
-            {"role": "user", "content": PROMPT_TEMPLATE.format(text=text)},
-        ],
-        max_tokens=3,
-        temperature=0,
+# Runs --since can be incremental against: completed ones, and batch runs still waiting
+# for their output (a run that died before saving any verdicts is neither).
+COUNTED_RUN = """
+    (finished_at IS NOT NULL
+      OR EXISTS (SELECT 1 FROM eval_run_verdict WHERE run_id = eval_run.id))
+"""
+
+
+def since_filter(conn, since, model, local=FUZZY_REJECT):
+    """
+    A condition on conversation_turn for --since, with its params. `since` is "last"
+    (the last completed or pending batch run with the same prompt_hash and model), "run:N",
+    or a time in any format analyze_conversations.parse_time takes. After a completed
+    run, it picks the turns saved since that run, plus the sessions whose judge requests
+    failed in it. After a pending batch run, only the turns saved since: the rest are
+    still waiting on that run's batch (see --run).
+    """
+    if since == "last" or since.startswith("run:"):
+        if since == "last":
+            row = conn.execute(
+                f"""
+                SELECT id, last_turn_id, finished_at FROM eval_run
+                WHERE eval_name = ? AND prompt_hash = ? AND model = ? AND {COUNTED_RUN}
+                ORDER BY id DESC LIMIT 1
+                """,
+                (EVAL_NAME, prompt_hash(local), model),
+            ).fetchone()
+            if row is None:
+                # nothing to be incremental against yet: judge everything
+                return "", ()
+        else:
+            row = conn.execute(
+                f"SELECT id, last_turn_id, finished_at FROM eval_run WHERE id = ? AND {COUNTED_RUN}",
+                (int(since[len("run:"):]),),
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"No completed or pending batch run {since[len('run:'):]}")
+        run_id, last_turn_id, finished_at = row
+        if finished_at is None:
+            return "AND id > ?", (last_turn_id,)
+        return (
+            """
+            AND (id > ? OR session_id IN (
+              SELECT session_id FROM eval_run_verdict WHERE run_id = ? AND verdict IS NULL
+            ))
+            """,
+            (last_turn_id, run_id),
+        )
+    return "AND turn_start_time >= ?", (analyze_conversations.parse_time(since),)
+
+
+def pending_turns(conn, run_id):
+    """(session_id, llm_text) for the sessions in a run that have no verdict yet."""
+    return conn.execute(
+        """
+        SELECT v.session_id, t.llm_response_text
+        FROM eval_run_verdict v
+        JOIN conversation_turn t ON t.session_id = v.session_id AND t.turn_number = 1
+        WHERE v.run_id = ? AND v.verdict IS NULL
+        ORDER BY v.session_id
+        """,
+        (run_id,),
+    ).fetchall()
+
+
+def start_run(conn, model, last_turn_id, since, local=FUZZY_REJECT):
+    with conn:
+        cursor = conn.execute(
+            """
+            INSERT INTO eval_run (eval_name, prompt_hash, model, started_at, last_turn_id, since)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (EVAL_NAME, prompt_hash(local), model, time.time(), last_turn_id, since),
+        )
+    return cursor.lastrowid
+
+
+def save_verdicts(conn, run_id, verdicts):
+    """Save (session_id, verdict or None, tier) rows for a run, replacing earlier ones."""
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO eval_run_verdict (run_id, session_id, verdict, tier) VALUES (?, ?, ?, ?)",
+            [(run_id, *row) for row in verdicts],
+        )
+
+
+def finish_run(conn, run_id, verdicts=()):
+    """Save the last of a run's verdicts and mark it completed, with its totals."""
+    save_verdicts(conn, run_id, verdicts)
+    with conn:
+        conn.execute(
+            """
+            UPDATE eval_run SET
+              finished_at = COALESCE(finished_at, ?),
+              num_judged = (SELECT COUNT(verdict) FROM eval_run_verdict WHERE run_id = eval_run.id),
+              num_passed = (
+                SELECT COUNT(*) FROM eval_run_verdict WHERE run_id = eval_run.id AND verdict = 'EXACT'
+              ),
+              num_errors = (
+                SELECT COUNT(*) FROM eval_run_verdict WHERE run_id = eval_run.id AND verdict IS NULL
+              )
+            WHERE id = ?
+            """,
+            (time.time(), run_id),
+        )
+
+
+def print_trend(conn):
+    rows = conn.execute(
+        """
+        SELECT id, started_at, model, prompt_hash, since, num_judged, num_passed, num_errors
+        FROM eval_run
+        WHERE eval_name = ? AND finished_at IS NOT NULL
+        ORDER BY id
+        """,
+        (EVAL_NAME,),
+    ).fetchall()
+    if not rows:
+        print("No completed runs yet.")
+        return
+    print(f"{'Run':>5}  {'Started':<19}  {'Model':<10} {'Prompt':<16} {'Since':<12} {'Judged':>7} {'Passed':>7} {'Pass %':>7} {'Errors':>7}")
+    for run_id, started_at, model, prompt, since, judged, passed, errors in rows:
+        percent = f"{passed / judged * 100:.1f}" if judged else "-"
+        print(
+            f"{run_id:>5}  {analyze_conversations.format_start_time(started_at):<19}  {model:<10} {prompt:<16} "
+            f"{since or 'all':<12} {judged:>7} {passed:>7} {percent:>7} {errors:>7}"
+        )
+
+
+def normalize(text):
+    """Lowercase, expand "I'm", and drop punctuation and extra whitespace."""
+    text = text.lower().replace("\u2019", "'")
+    text = re.sub(r"\bi'm\b", "i am", text)
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+
+def local_verdict(text, reject=FUZZY_REJECT):
+    """
+    Return (tier, verdict) when the text can be judged without the LLM, else (None, None).
+
+    "exact" passes a text whose normalized words are exactly the greeting's. "fuzzy" only
+    ever fails a text: the greeting with words before or after it, or a text whose
+    similarity to the greeting is clearly low.
+    """
+    greeting = normalize(GREETING)
+    normalized = normalize(text)
+    if normalized == greeting:
+        return "exact", "EXACT"
+    if re.search(rf"\b{re.escape(greeting)}\b", normalized):
+        return "fuzzy", "NOT EXACT"
+    similarity = difflib.SequenceMatcher(None, normalized, greeting).ratio()
+    if similarity < reject:
+        return "fuzzy", "NOT EXACT"
+    return None, None
+
+
+def judge_messages(text):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": PROMPT_TEMPLATE.format(text=text)},
+    ]
+
+
+async def check_with_gpt4o(client, cache, text):
+    messages = judge_messages(text)
+    if cache is None:
+        return await client.complete(messages, max_tokens=MAX_TOKENS, temperature=TEMPERATURE)
+    return await cache.complete(client, messages, max_tokens=MAX_TOKENS, temperature=TEMPERATURE)
+
+
+async def judge(client, cache, text, local):
+    """Return (tier, verdict), asking the LLM only when the local checks can't decide."""
+    if local is not None:
+        tier, verdict = local_verdict(text, local)
+        if tier:
+            return tier, verdict
+    return "llm", await check_with_gpt4o(client, cache, text)
+
+
+async def judge_in_order(first_turns, client, cache, window, local=FUZZY_REJECT):
+    """
+    Yield (session_id, llm_text, (tier, verdict) or exception) in the order of
+    first_turns. Up to `window` turns are started ahead of the one being printed; the
+    client decides how many LLM requests are actually in flight. `local` is the reject
+    threshold for the local checks, or None to send everything to the LLM.
+    """
+    pending = collections.deque()
+    turns = iter(first_turns)
+
+    def fill():
+        while len(pending) < window:
+            turn = next(turns, None)
+            if turn is None:
+                return
+            session_id, llm_text = turn
+            pending.append((session_id, llm_text, asyncio.ensure_future(judge(client, cache, llm_text or "", local))))
+
+    fill()
+    try:
+        while pending:
+            session_id, llm_text, task = pending.popleft()
+            try:
+                result = await task
+            except (openai.APIError, ValueError) as e:
+                # ValueError covers a response with no text (judge_client.EmptyResponseError)
+                result = e
+            fill()
+            yield session_id, llm_text, result
+    finally:
+        for _, _, task in pending:
+            task.cancel()
+
+
+async def run_checks(first_turns, openai_api_key, args, cache=None):
+    """Judge and print every turn, then the summary. Returns (session_id, verdict, tier) rows."""
+    client = JudgeClient(
+        api_key=openai_api_key,
+        model=MODEL,
+        concurrency=args.concurrency,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        base_url=args.base_url,
+        recorder=JudgeRecorder(args.record) if args.record else None,
     )
-    return response.choices[0].message.content.strip()
+    total = 0
+    correct = 0
+    incorrect = 0
+    errors = 0
+    tiers = collections.Counter()
+    verdicts = []
+    local = None if args.llm_only else args.fuzzy_reject
+    try:
+        progress = tqdm(total=len(first_turns))
+        async for session_id, llm_text, result in judge_in_order(
+            first_turns, client, cache, args.concurrency * 4, local
+        ):
+            progress.update()
+            if isinstance(result, Exception):
+                errors += 1
+                verdicts.append((session_id, None, None))
+                print(
+                    f"Session: {session_id}\nFirst turn (LLM): {llm_text}\nError: {result}\n{'-' * 40}"
+                )
+                continue
+            tier, result = result
+            tiers[tier] += 1
+            verdicts.append((session_id, result.upper(), tier))
+            print(
+                f"Session: {session_id}\nFirst turn (LLM): {llm_text}\nResult: {result} ({tier})\n{'-' * 40}"
+            )
+            total += 1
+            if result.upper() == "EXACT":
+                correct += 1
+            else:
+                incorrect += 1
+        progress.close()
+    finally:
+        await client.close()
+        if cache is not None:
+            cache.flush()
+    percent = (correct / total * 100) if total > 0 else 0.0
+    print(f"\nSummary:")
+    print(f"Total tested: {total}")
+    print(f"Correct (EXACT): {correct}")
+    print(f"Incorrect (NOT EXACT): {incorrect}")
+    print(f"Percentage correct: {percent:.1f}%")
+    if errors:
+        print(f"Failed after retries: {errors}")
+    print(f"Judged by: exact match {tiers['exact']}, fuzzy match {tiers['fuzzy']}, LLM {tiers['llm']}")
+    if cache is not None:
+        print(
+            f"Cache: {cache.hits} hits, {cache.deduplicated} repeats judged once this run, {cache.misses} misses"
+        )
+    print(f"API requests: {client.requests} ({client.retries} retries)")
+    return verdicts
+
+
+def batch_custom_id(run_id, key):
+    return f"run-{run_id}-{key}"
+
+
+def write_batch(conn, first_turns, path, run_id, local, cache=None):
+    """
+    Write the turns that need the LLM to `path` in the OpenAI batch input format, one
+    line per distinct request. Turns decided locally or from the cache get their verdict
+    now; the rest are saved with none until ingest_batch() fills them in. Returns
+    (batch lines, tier counts).
+    """
+    tiers = collections.Counter()
+    verdicts = []
+    requests = {}
+    for session_id, llm_text in first_turns:
+        text = llm_text or ""
+        tier, verdict = local_verdict(text, local) if local is not None else (None, None)
+        if tier is None:
+            messages = judge_messages(text)
+            key = JudgeCache.key(messages, MODEL, TEMPERATURE, MAX_TOKENS)
+            tier = "llm"
+            verdict = cache.get(key) if cache else None
+            if verdict is None:
+                tier = "batch"
+                requests[key] = messages
+            else:
+                verdict = verdict.upper()
+        tiers[tier] += 1
+        verdicts.append((session_id, verdict, "llm" if tier == "batch" else tier))
+    with open(path, "w", encoding="utf-8") as f:
+        for key, messages in requests.items():
+            body = dict(model=MODEL, messages=messages, max_tokens=MAX_TOKENS, temperature=TEMPERATURE)
+            line = {
+                "custom_id": batch_custom_id(run_id, key),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body,
+            }
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    save_verdicts(conn, run_id, verdicts)
+    return len(requests), tiers
+
+
+def ingest_batch(conn, path):
+    """
+    Read an OpenAI batch output file and fill in the verdicts its runs were waiting for.
+    Responses also go into the judge cache. A run is marked completed once it has no
+    verdicts missing. Ingesting the same file again changes nothing. Returns
+    (responses read, failed requests, {run_id: verdicts still missing}).
+    """
+    responses = collections.defaultdict(dict)
+    cache_rows = []
+    failed = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            _, run_id, key = result["custom_id"].split("-", 2)
+            run_responses = responses[int(run_id)]
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                failed += 1
+                continue
+            body = response["body"]
+            content = body["choices"][0]["message"]["content"]
+            if content is None:
+                failed += 1
+                continue
+            content = content.strip()
+            run_responses[key] = content
+            cache_rows.append((key, body.get("model", MODEL), content))
+    JudgeCache(conn).put_many(cache_rows)
+    missing = {}
+    for run_id, run_responses in responses.items():
+        pending = pending_turns(conn, run_id)
+        verdicts = []
+        for session_id, llm_text in pending:
+            key = JudgeCache.key(judge_messages(llm_text or ""), MODEL, TEMPERATURE, MAX_TOKENS)
+            if key in run_responses:
+                verdicts.append((session_id, run_responses[key].upper(), "llm"))
+        missing[run_id] = len(pending) - len(verdicts)
+        if missing[run_id]:
+            save_verdicts(conn, run_id, verdicts)
+        else:
+            finish_run(conn, run_id, verdicts)
+    return sum(len(r) for r in responses.values()), failed, missing
+
+
+def resubmit_batch(conn, run_id, path, cache=None):
+    """Write the batch requests an unfinished run is still missing verdicts for to `path`."""
+    row = conn.execute("SELECT finished_at FROM eval_run WHERE id = ?", (run_id,)).fetchone()
+    if row is None:
+        print(f"No run {run_id}.")
+        return
+    if row[0] is not None:
+        print(f"Run {run_id} is already completed.")
+        return
+    # these turns already went through the local checks when the run was written
+    lines, tiers = write_batch(conn, pending_turns(conn, run_id), path, run_id, None, cache)
+    if lines:
+        print(f"Run {run_id}: wrote {lines} requests for {tiers['batch']} turns to {path}.")
+        print("Submit it to the batch API, then run with --ingest-batch <output file>.")
+    else:
+        finish_run(conn, run_id)
+        print(f"Run {run_id}: no requests left to send; marked completed.")
 
 
 def main():
@@ -52,41 +459,159 @@ def main():
         action="store_true",
         help="Don't call OpenAI API, just print first turns.",
     )
+    parser.add_argument(
+        "--since",
+        default=None,
+        help=(
+            "Only judge sessions newer than this: 'last' for the last completed run, 'run:N' "
+            "for run N, or a unix time, local ISO date/time, or duration ago like 24h."
+        ),
+    )
+    parser.add_argument(
+        "--trend",
+        action="store_true",
+        help="Print the pass rate of every completed run and exit.",
+    )
+    parser.add_argument(
+        "--batch-out",
+        default=None,
+        help="Don't call the API: write the requests that need the LLM to this file, for the OpenAI batch API.",
+    )
+    parser.add_argument(
+        "--ingest-batch",
+        default=None,
+        help="Read an OpenAI batch output file and save its verdicts, then exit.",
+    )
+    parser.add_argument(
+        "--run",
+        type=int,
+        default=None,
+        help="With --batch-out: write the requests run N is still missing verdicts for, to resubmit them.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="Maximum judge requests in flight (default: 16).",
+    )
+    parser.add_argument(
+        "--rpm",
+        type=float,
+        default=500,
+        help="Requests per minute to stay under (default: 500).",
+    )
+    parser.add_argument(
+        "--tpm",
+        type=float,
+        default=None,
+        help="Tokens per minute to stay under (default: no limit).",
+    )
+    parser.add_argument(
+        "--fuzzy-reject",
+        type=float,
+        default=FUZZY_REJECT,
+        help=f"Similarity below which a text fails without the LLM (default: {FUZZY_REJECT}).",
+    )
+    parser.add_argument(
+        "--llm-only",
+        action="store_true",
+        help="Send every turn to the LLM, skipping the local checks.",
+    )
+    parser.add_argument(
+        "--base-url",
+        default=None,
+        help="Send judge requests here instead of to OpenAI, e.g. a judge_replay.py server.",
+    )
+    parser.add_argument(
+        "--record",
+        default=None,
+        help="Append every judge request and response to this JSONL file, for judge_replay.py.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Judge every turn, even ones whose text has been judged before.",
+    )
     args = parser.parse_args()
 
+    if args.trend:
+        conn = sqlite3.connect(DB_PATH)
+        migrations.migrate(conn)
+        print_trend(conn)
+        conn.close()
+        return
+
+    if args.ingest_batch:
+        conn = sqlite3.connect(DB_PATH)
+        migrations.migrate(conn)
+        read, failed, missing = ingest_batch(conn, args.ingest_batch)
+        conn.close()
+        print(f"Read {read} responses ({failed} failed requests).")
+        for run_id, count in sorted(missing.items()):
+            if count:
+                print(
+                    f"Run {run_id}: {count} verdicts still missing; resubmit them with "
+                    f"--batch-out <file> --run {run_id} and ingest the output to finish it."
+                )
+            else:
+                print(f"Run {run_id}: completed.")
+        return
+
     load_dotenv(override=True)
     openai_api_key = os.environ.get("OPENAI_API_KEY")
-    if not args.no_api and not openai_api_key:
-        print("Please set the OPENAI_API_KEY environment variable in your .env file.")
+    if not args.no_api and not args.batch_out and not openai_api_key:
+        if not args.base_url:
+            print("Please set the OPENAI_API_KEY environment variable in your .env file.")
+            return
+        # a local stand-in doesn't check it, but the client needs one
+        openai_api_key = "unused"
+
+    if args.run is not None:
+        if not args.batch_out:
+            parser.error("--run needs --batch-out")
+        conn = sqlite3.connect(DB_PATH)
+        migrations.migrate(conn)
+        resubmit_batch(conn, args.run, args.batch_out, None if args.no_cache else JudgeCache(conn))
+        conn.close()
         return
 
     conn = sqlite3.connect(DB_PATH)
-    first_turns = get_first_turns(conn)
-    conn.close()
+    migrations.migrate(conn)
+    # turns saved after this are left for the next run
+    last_turn_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM conversation_turn").fetchone()[0]
+    local = None if args.llm_only else args.fuzzy_reject
+    try:
+        where, params = since_filter(conn, args.since, MODEL, local) if args.since else ("", ())
+    except ValueError as e:
+        print(f"Bad --since: {e}")
+        conn.close()
+        return
+    first_turns = get_first_turns(conn, where + " AND id <= ?", (*params, last_turn_id))
 
-    total = 0
-    correct = 0
-    incorrect = 0
-    for session_id, llm_text in tqdm(first_turns):
-        if args.no_api:
+    if args.no_api:
+        conn.close()
+        for session_id, llm_text in first_turns:
             print(f"Session: {session_id}\nFirst turn (LLM): {llm_text}\n{'-' * 40}")
-        else:
-            result = check_with_gpt4o(llm_text or "", openai_api_key)
+        return
+    cache = None if args.no_cache else JudgeCache(conn)
+    run_id = start_run(conn, MODEL, last_turn_id, args.since, local)
+    if args.batch_out:
+        lines, tiers = write_batch(conn, first_turns, args.batch_out, run_id, local, cache)
+        if lines:
             print(
-                f"Session: {session_id}\nFirst turn (LLM): {llm_text}\nResult: {result}\n{'-' * 40}"
+                f"Run {run_id}: wrote {lines} requests for {tiers['batch']} turns to {args.batch_out}. "
+                f"Decided now: exact match {tiers['exact']}, fuzzy match {tiers['fuzzy']}, cache {tiers['llm']}."
             )
-            total += 1
-            if result.upper() == "EXACT":
-                correct += 1
-            else:
-                incorrect += 1
-    if not args.no_api:
-        percent = (correct / total * 100) if total > 0 else 0.0
-        print(f"\nSummary:")
-        print(f"Total tested: {total}")
-        print(f"Correct (EXACT): {correct}")
-        print(f"Incorrect (NOT EXACT): {incorrect}")
-        print(f"Percentage correct: {percent:.1f}%")
+            print("Submit it to the batch API, then run with --ingest-batch <output file>.")
+        else:
+            finish_run(conn, run_id)
+            print(f"Run {run_id}: nothing needs the LLM; saved as a completed run.")
+        conn.close()
+        return
+    verdicts = asyncio.run(run_checks(first_turns, openai_api_key, args, cache))
+    finish_run(conn, run_id, verdicts)
+    print(f"Saved as run {run_id}.")
+    conn.close()
 
 
 if __name__ == "__main__":
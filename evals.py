@@ -0,0 +1,366 @@
+"""
+Batched LLM evals over every turn in the conversation db.
+
+An `Eval` is three things:
+
+- `where`: a SQL condition on conversation_turn that picks the turns it applies to
+- `instructions`: the prompt, saying what to check for each turn
+- `parse`: turns the judge's JSON response into {turn_id: (passed, detail)}
+
+All evals run in one pass over the db. Each turn is routed to every eval whose condition
+it matches, and each eval packs its turns into batches of `batch_size` per judge
+request, asking for JSON back. API round trips scale with the number of batches, not
+with turns x evals. Verdicts go to the eval_result table, one row per eval and turn.
+
+    python evals.py [--eval NAME ...] [--batch-size N] [--concurrency N] [--rpm N]
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sqlite3
+import time
+
+import openai
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+import migrations
+from judge_client import JudgeCache, JudgeClient, JudgeRecorder
+
+DB_PATH = os.path.join(
+    os.path.dirname(__file__), "db-and-recordings/conversation_turns.db"
+)
+
+MODEL = "gpt-4o"
+TEMPERATURE = 0
+BATCH_SIZE = 20
+FETCH_SIZE = 1000
+
+SYSTEM_PROMPT = "You are a strict evaluator of voice assistant conversations. Respond only with JSON."
+
+BATCH_TEMPLATE = """{instructions}
+
+Judge each item on its own. Respond with a JSON object of the form
+{{"results": [{{"id": <item id>, "pass": true or false, "reason": "<a few words>"}}]}}
+with exactly one result for every item.
+
+ITEMS:
+
+{items}"""
+
+COLUMN_LABELS = {
+    "user_speech_text": "user",
+    "llm_response_text": "assistant",
+}
+
+
+def parse_pass_fail(response):
+    """Parse the {"results": [{"id", "pass", "reason"}]} shape BATCH_TEMPLATE asks for."""
+    verdicts = {}
+    for result in json.loads(response)["results"]:
+        passed = result.get("pass")
+        verdicts[int(result["id"])] = (None if passed is None else bool(passed), result.get("reason"))
+    return verdicts
+
+
+class Eval:
+    def __init__(
+        self,
+        name,
+        where,
+        instructions,
+        columns=("llm_response_text",),
+        parse=parse_pass_fail,
+        template=BATCH_TEMPLATE,
+        tokens_per_turn=40,
+    ):
+        self.name = name
+        self.where = where
+        self.instructions = instructions
+        self.columns = columns  # conversation_turn columns shown to the judge
+        self.parse = parse
+        self.template = template
+        self.tokens_per_turn = tokens_per_turn  # response budget per turn in a batch
+
+    def messages(self, turns):
+        items = [
+            {"id": turn["id"], **{COLUMN_LABELS.get(column, column): turn[column] or "" for column in self.columns}}
+            for turn in turns
+        ]
+        prompt = self.template.format(
+            instructions=self.instructions,
+            items="\n".join(json.dumps(item, ensure_ascii=False) for item in items),
+        )
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ]
+
+    def max_tokens(self, turns):
+        return 20 + self.tokens_per_turn * len(turns)
+
+
+EVALS = [
+    Eval(
+        "first_turn_greeting",
+        "turn_number = 1",
+        "Each item is the assistant's first turn in a voice conversation. It passes if it is "
+        "the phrase 'I am here and ready to help' and nothing else. Ignore punctuation, "
+        "spacing and contractions, but any other text before or after the phrase fails.",
+    ),
+    Eval(
+        "responsive",
+        "turn_number > 1 AND COALESCE(user_speech_text, '') <> ''",
+        "Each item is one turn of a voice conversation: what the user said (transcribed) "
+        "and the assistant's reply. It passes if the reply responds to what the user said. "
+        "Transcription errors in the user's words are expected; judge by the likely intent.",
+        columns=("user_speech_text", "llm_response_text"),
+    ),
+    Eval(
+        "speakable",
+        "COALESCE(llm_response_text, '') <> ''",
+        "Each item is an assistant reply that will be spoken by a text-to-speech voice. It "
+        "passes if it reads naturally out loud: no markdown, bullet lists, emoji, URLs, or "
+        "code, and no more than a few sentences.",
+    ),
+]
+
+
+def select_turns(conn, evals):
+    """
+    Yield (turn, [evals it matches]) for every turn matching at least one eval, with one
+    query over conversation_turn.
+    """
+    conditions = [f"COALESCE(({e.where}), 0) AS match_{i}" for i, e in enumerate(evals)]
+    cursor = conn.execute(
+        f"""
+        SELECT id, session_id, turn_number, user_speech_text, llm_response_text,
+          {', '.join(conditions)}
+        FROM conversation_turn
+        WHERE {' OR '.join(f'({e.where})' for e in evals)}
+        ORDER BY id
+        """
+    )
+    names = [column[0] for column in cursor.description]
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        for row in rows:
+            turn = dict(zip(names, row))
+            yield turn, [e for i, e in enumerate(evals) if turn[f"match_{i}"]]
+
+
+async def judge_batch(client, cache, ev, turns):
+    messages = ev.messages(turns)
+    kwargs = {"response_format": {"type": "json_object"}}
+    # a reply cut off at max_tokens is malformed JSON at best, so it fails the batch
+    if cache is None:
+        response = await client.complete(
+            messages, ev.max_tokens(turns), TEMPERATURE, allow_truncated=False, **kwargs
+        )
+    else:
+        # only replies that parse are cached, so a bad one is asked for again next run
+        response = await cache.complete(
+            client,
+            messages,
+            ev.max_tokens(turns),
+            TEMPERATURE,
+            validate=ev.parse,
+            allow_truncated=False,
+            **kwargs,
+        )
+    return ev.parse(response)
+
+
+class Totals:
+    def __init__(self):
+        self.judged = 0
+        self.passed = 0
+        self.failed = 0
+        self.missing = 0  # turns the judge left out of its response, or whose batch failed
+
+
+def verdict_rows(ev, model, verdicts):
+    now = time.time()
+    return [(ev.name, turn_id, passed, detail, model, now) for turn_id, (passed, detail) in verdicts.items()]
+
+
+def save_verdicts(conn, rows):
+    """Save verdict_rows() in one transaction, replacing earlier verdicts."""
+    with conn:
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO eval_result (eval_name, turn_id, passed, detail, model, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+
+
+async def run_evals(conn, evals, client, cache=None, batch_size=BATCH_SIZE, window=64):
+    """
+    Judge every matching turn and save the verdicts. Up to `window` batches are started
+    ahead of the one being finished; the client decides how many are actually in flight.
+    Returns {eval name: Totals}.
+
+    Verdicts (and new cache entries) are held in memory and written in one transaction
+    when the run ends, even if it fails. A commit per batch would run on the event loop,
+    so while a bot held the db's write lock it would stall every request in flight.
+    """
+    totals = {ev.name: Totals() for ev in evals}
+    pending = collections.deque()
+    rows = []
+    progress = tqdm(unit="turn")
+
+    async def finish_oldest():
+        ev, turns, task = pending.popleft()
+        total = totals[ev.name]
+        try:
+            verdicts = await task
+        except (openai.APIError, ValueError, KeyError, TypeError) as e:
+            # ValueError covers malformed JSON; KeyError and TypeError a response of the
+            # wrong shape
+            print(f"{ev.name}: batch of {len(turns)} turns failed: {e!r}")
+            verdicts = {}
+        verdicts = {turn["id"]: verdicts[turn["id"]] for turn in turns if turn["id"] in verdicts}
+        rows.extend(verdict_rows(ev, client.model, verdicts))
+        total.judged += len(verdicts)
+        total.passed += sum(1 for passed, _ in verdicts.values() if passed is True)
+        total.failed += sum(1 for passed, _ in verdicts.values() if passed is False)
+        total.missing += len(turns) - len(verdicts)
+        progress.update(len(turns))
+
+    async def submit(ev, turns):
+        pending.append((ev, turns, asyncio.ensure_future(judge_batch(client, cache, ev, turns))))
+        while len(pending) > window:
+            await finish_oldest()
+
+    batches = {ev.name: [] for ev in evals}
+    try:
+        for turn, matched in select_turns(conn, evals):
+            for ev in matched:
+                batch = batches[ev.name]
+                batch.append(turn)
+                if len(batch) >= batch_size:
+                    batches[ev.name] = []
+                    await submit(ev, batch)
+        for ev in evals:
+            if batches[ev.name]:
+                await submit(ev, batches[ev.name])
+        while pending:
+            await finish_oldest()
+    finally:
+        for _, _, task in pending:
+            task.cancel()
+        progress.close()
+        save_verdicts(conn, rows)
+        if cache is not None:
+            cache.flush()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run batched LLM evals over the turns in the conversation db."
+    )
+    parser.add_argument("--db", default=DB_PATH, help="Path to the sqlite db file.")
+    parser.add_argument(
+        "--eval",
+        action="append",
+        choices=[ev.name for ev in EVALS],
+        help="Eval to run; may be given more than once (default: all of them).",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help=f"Turns per judge request (default: {BATCH_SIZE}).",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="Maximum judge requests in flight (default: 16).",
+    )
+    parser.add_argument(
+        "--rpm",
+        type=float,
+        default=500,
+        help="Requests per minute to stay under (default: 500).",
+    )
+    parser.add_argument(
+        "--tpm",
+        type=float,
+        default=None,
+        help="Tokens per minute to stay under (default: no limit).",
+    )
+    parser.add_argument(
+        "--base-url",
+        default=None,
+        help="Send judge requests here instead of to OpenAI, e.g. a judge_replay.py server.",
+    )
+    parser.add_argument(
+        "--record",
+        default=None,
+        help="Append every judge request and response to this JSONL file, for judge_replay.py.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Send every batch to the judge, even ones that have been judged before.",
+    )
+    args = parser.parse_args()
+
+    load_dotenv(override=True)
+    openai_api_key = os.environ.get("OPENAI_API_KEY")
+    if not openai_api_key:
+        if not args.base_url:
+            print("Please set the OPENAI_API_KEY environment variable in your .env file.")
+            return
+        # a local stand-in doesn't check it, but the client needs one
+        openai_api_key = "unused"
+
+    evals = [ev for ev in EVALS if not args.eval or ev.name in args.eval]
+    conn = sqlite3.connect(args.db)
+    migrations.migrate(conn)
+    cache = None if args.no_cache else JudgeCache(conn)
+    recorder = JudgeRecorder(args.record) if args.record else None
+
+    async def run():
+        client = JudgeClient(
+            api_key=openai_api_key,
+            model=MODEL,
+            concurrency=args.concurrency,
+            requests_per_minute=args.rpm,
+            tokens_per_minute=args.tpm,
+            base_url=args.base_url,
+            recorder=recorder,
+        )
+        try:
+            return client, await run_evals(
+                conn, evals, client, cache, args.batch_size, args.concurrency * 4
+            )
+        finally:
+            await client.close()
+
+    client, totals = asyncio.run(run())
+    conn.close()
+
+    print(f"\n{'Eval':<24} {'Judged':>8} {'Passed':>8} {'Failed':>8} {'Missing':>8} {'Pass %':>8}")
+    for name, total in totals.items():
+        decided = total.passed + total.failed
+        percent = f"{total.passed / decided * 100:.1f}" if decided else "-"
+        print(
+            f"{name:<24} {total.judged:>8} {total.passed:>8} {total.failed:>8} {total.missing:>8} {percent:>8}"
+        )
+    if cache is not None:
+        print(f"Cache: {cache.hits} hits, {cache.misses} misses")
+    print(f"API requests: {client.requests} ({client.retries} retries)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+A shared async client for LLM-judge scripts.
+
+One AsyncOpenAI client (one connection pool) serves every request. Throughput is limited
+by three things:
+
+- at most `concurrency` requests in flight
+- a token bucket of `requests_per_minute`
+- optionally, a token bucket of `tokens_per_minute`, charged with a rough estimate of
+  each request's prompt plus its max_tokens
+
+Rate-limit (429), server (5xx), timeout and connection errors are retried with
+exponential backoff and full jitter. A Retry-After from the server is honored when
+there is one. The OpenAI library's own retries are turned off so they don't stack on
+top of ours.
+
+`JudgeCache` stores responses in the conversation db, so a text is only ever judged once
+for a given prompt, model and temperature.
+
+`JudgeRecorder` appends every request and its response to a JSONL file, which
+judge_replay.py can serve back from a local stand-in for the API.
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import time
+
+import openai
+
+DEFAULT_MODEL = "gpt-4o"
+
+
+class TokenBucket:
+    """Allows `rate` units per second on average, in bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        # the lock makes waiters queue up in order, so a big request isn't starved by
+        # a stream of small ones
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+
+class TruncatedResponseError(ValueError):
+    """The completion stopped at max_tokens (finish_reason "length")."""
+
+    def __init__(self, content):
+        super().__init__(f"Response cut off at max_tokens: {content!r}")
+        self.content = content
+
+
+class EmptyResponseError(ValueError):
+    """The completion has no text content (a refusal, say)."""
+
+    def __init__(self, finish_reason):
+        super().__init__(f"Response has no content (finish_reason {finish_reason!r})")
+        self.finish_reason = finish_reason
+
+
+def _retryable(error):
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class JudgeClient:
+    def __init__(
+        self,
+        api_key=None,
+        model=DEFAULT_MODEL,
+        concurrency=16,
+        requests_per_minute=500,
+        tokens_per_minute=None,
+        max_retries=6,
+        base_url=None,
+        recorder=None,
+    ):
+        self.model = model
+        self.max_retries = max_retries
+        self.recorder = recorder
+        self._client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._requests = TokenBucket(requests_per_minute / 60, capacity=max(1, concurrency))
+        self._tokens = (
+            TokenBucket(tokens_per_minute / 60, capacity=tokens_per_minute) if tokens_per_minute else None
+        )
+        self.requests = 0
+        self.retries = 0
+
+    async def complete(self, messages, max_tokens, temperature=0, allow_truncated=True, **kwargs):
+        """
+        Return the text of one chat completion, retrying transient errors. A response
+        with no text raises EmptyResponseError. With allow_truncated=False, a response
+        cut off at max_tokens raises TruncatedResponseError.
+        """
+        # about 4 characters per token is close enough for rate limiting
+        estimated_tokens = sum(len(message["content"]) for message in messages) // 4 + max_tokens
+        request = dict(
+            model=self.model, messages=messages, max_tokens=max_tokens, temperature=temperature, **kwargs
+        )
+        for attempt in range(self.max_retries + 1):
+            await self._requests.acquire()
+            if self._tokens:
+                await self._tokens.acquire(estimated_tokens)
+            try:
+                async with self._semaphore:
+                    self.requests += 1
+                    response = await self._client.chat.completions.create(**request)
+                choice = response.choices[0]
+                if not allow_truncated and choice.finish_reason == "length":
+                    raise TruncatedResponseError(choice.message.content)
+                if choice.message.content is None:
+                    raise EmptyResponseError(choice.finish_reason)
+                content = choice.message.content.strip()
+                if self.recorder:
+                    self.recorder.record(request, content)
+                return content
+            except openai.APIError as e:
+                if attempt == self.max_retries or not _retryable(e):
+                    raise
+                self.retries += 1
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(30.0, 0.5 * 2**attempt))
+                await asyncio.sleep(delay)
+
+    async def close(self):
+        await self._client.close()
+        if self.recorder:
+            self.recorder.close()
+
+
+class JudgeCache:
+    """
+    Judge responses keyed by a hash of the request: the messages (so the prompt template
+    and the text being judged), model, temperature, max_tokens and any other request
+    options. Change any of them and the key changes, so stale verdicts are never reused.
+
+    Identical requests made while one is already in flight wait for it instead of
+    making their own.
+
+    With a `validate` callable (a response parser, say), a response is only cached if
+    validate(response) doesn't raise, and a cached response that fails it is deleted
+    and asked for again. So a malformed reply is never reused.
+
+    complete() runs on the event loop, so it never writes to the db: new responses and
+    deletions are held in memory (and served from there) until `flush()` saves them in
+    one transaction at the end of the run. A write could otherwise stall every request
+    in flight while a bot holds the db's write lock. Lookups are WAL reads, which don't
+    wait on writers.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._in_flight = {}
+        self._pending = {}  # key -> (model, response), or None to delete it
+        self.hits = 0
+        self.deduplicated = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(messages, model, temperature, max_tokens, **kwargs):
+        request = [messages, model, temperature, max_tokens]
+        if kwargs:
+            request.append(kwargs)
+        request = json.dumps(request, sort_keys=True)
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def get(self, key):
+        if key in self._pending:
+            pending = self._pending[key]
+            return pending[1] if pending else None
+        row = self._conn.execute("SELECT response FROM judge_cache WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def delete(self, key):
+        self._pending[key] = None
+
+    def put(self, key, model, response):
+        self._pending[key] = (model, response)
+
+    def flush(self):
+        """Save the responses and deletions held since the last flush. Returns how many."""
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        deleted = [(key,) for key, row in pending.items() if row is None]
+        now = time.time()
+        with self._conn:
+            self._conn.executemany("DELETE FROM judge_cache WHERE key = ?", deleted)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO judge_cache (key, model, response, created_at) VALUES (?, ?, ?, ?)",
+                [(key, *row, now) for key, row in pending.items() if row is not None],
+            )
+        return len(pending)
+
+    def put_many(self, rows):
+        """Save (key, model, response) rows in one transaction, straight away."""
+        now = time.time()
+        # commit straight away: the bots may be writing to this db, and an open write
+        # transaction would hold them up
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO judge_cache (key, model, response, created_at) VALUES (?, ?, ?, ?)",
+                [(key, model, response, now) for key, model, response in rows],
+            )
+
+    async def complete(
+        self, client, messages, max_tokens, temperature=0, validate=None, allow_truncated=True, **kwargs
+    ):
+        """client.complete(), unless this request has been made before."""
+        key = self.key(messages, client.model, temperature, max_tokens, **kwargs)
+        response = self.get(key)
+        if response is not None:
+            try:
+                if validate:
+                    validate(response)
+                self.hits += 1
+                return response
+            except (ValueError, KeyError, TypeError):
+                self.delete(key)
+        if key in self._in_flight:
+            self.deduplicated += 1
+            return await asyncio.shield(self._in_flight[key])
+        self.misses += 1
+        future = self._in_flight[key] = asyncio.ensure_future(
+            client.complete(messages, max_tokens, temperature, allow_truncated=allow_truncated, **kwargs)
+        )
+        try:
+            response = await asyncio.shield(future)
+        finally:
+            del self._in_flight[key]
+        if validate:
+            validate(response)
+        self.put(key, client.model, response)
+        return response
+
+
+def request_key(request):
+    """A hash of a chat completion request body, for matching replayed requests."""
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+
+class JudgeRecorder:
+    """Appends {"request": ..., "response": ...} lines to a JSONL file."""
+
+    def __init__(self, path):
+        self._file = open(path, "a", encoding="utf-8")
+
+    def record(self, request, response):
+        self._file.write(json.dumps({"request": request, "response": response}, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def load_recordings(path):
+    """Read a JudgeRecorder file into {request_key: response}. Later lines win."""
+    recordings = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                pair = json.loads(line)
+                recordings[request_key(pair["request"])] = pair["response"]
+    return recordings
@@ -0,0 +1,204 @@
+"""
+A local, OpenAI-compatible stand-in for the judge API.
+
+It serves POST /v1/chat/completions from request/response pairs recorded by
+judge_client.JudgeRecorder (the scripts' --record option), matching each request on a
+hash of its body. Requests that weren't recorded get a 404, or the --fallback text if
+one is set. Latency and errors can be injected:
+
+- each response waits --latency-ms, plus up to --jitter-ms more
+- --error-rate of requests fail with a 429 (with a Retry-After of --retry-after
+  seconds) or a 500, chosen at random
+
+With a --seed, the same requests in the same order see the same delays and errors, so
+concurrency, caching and retry behavior can be benchmarked offline and reproducibly.
+GET /stats returns request counts.
+
+    python judge_replay.py recordings.jsonl [--port 8765] [--latency-ms 300] [--error-rate 0.05]
+    python check_first_turn_greeting.py --base-url http://127.0.0.1:8765/v1
+
+With --batch-input and --batch-output it answers an OpenAI batch input file instead,
+writing the output file the batch API would, so check_first_turn_greeting.py's
+--batch-out / --ingest-batch cycle can be run without the API.
+
+    python judge_replay.py [recordings.jsonl] --fallback EXACT --batch-input in.jsonl --batch-output out.jsonl
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from judge_client import load_recordings, request_key
+
+DEFAULT_PORT = 8765
+
+
+def _error(status, message, error_type, headers=None):
+    return JSONResponse(
+        {"error": {"message": message, "type": error_type, "param": None, "code": None}},
+        status_code=status,
+        headers=headers,
+    )
+
+
+def completion(body, content, completion_id):
+    """A chat completion response body for `body`, answering with `content`."""
+    prompt_tokens = sum(len(message["content"]) for message in body["messages"]) // 4
+    completion_tokens = len(content) // 4 + 1
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body["model"],
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def answer_batch(recordings, input_path, output_path, fallback=None, error_rate=0, seed=None):
+    """
+    Write the batch output file for an OpenAI batch input file: recorded responses, the
+    fallback for anything unrecorded, and `error_rate` of requests failed with a 500.
+    Returns the number of lines written.
+    """
+    rng = random.Random(seed)
+    count = 0
+    with open(input_path, encoding="utf-8") as f, open(output_path, "w", encoding="utf-8") as out:
+        for line in f:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            count += 1
+            result = {"id": f"batch_req_replay_{count}", "custom_id": request["custom_id"], "error": None}
+            content = recordings.get(request_key(request["body"]), fallback)
+            if rng.random() < error_rate:
+                status, body = 500, {"error": {"message": "Injected server error", "type": "server_error"}}
+            elif content is None:
+                status = 404
+                body = {"error": {"message": "No recorded response for this request", "type": "invalid_request_error"}}
+            else:
+                status, body = 200, completion(request["body"], content, f"chatcmpl-replay-{count}")
+            result["response"] = {"status_code": status, "request_id": f"replay-{count}", "body": body}
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return count
+
+
+def create_app(
+    recordings,
+    latency_ms=0,
+    jitter_ms=0,
+    error_rate=0,
+    retry_after=None,
+    fallback=None,
+    seed=None,
+):
+    app = FastAPI()
+    rng = random.Random(seed)
+    stats = collections.Counter()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        # draw everything up front, so each request uses the same number of draws
+        delay = (latency_ms + rng.uniform(0, jitter_ms)) / 1000
+        fail = rng.random() < error_rate
+        rate_limited = rng.random() < 0.5
+        await asyncio.sleep(delay)
+        if fail:
+            if rate_limited:
+                stats["429"] += 1
+                headers = {"retry-after": str(retry_after)} if retry_after is not None else None
+                return _error(429, "Injected rate limit", "rate_limit_error", headers)
+            stats["500"] += 1
+            return _error(500, "Injected server error", "server_error")
+        content = recordings.get(request_key(body))
+        if content is None:
+            if fallback is None:
+                stats["misses"] += 1
+                return _error(404, "No recorded response for this request", "invalid_request_error")
+            stats["fallbacks"] += 1
+            content = fallback
+        else:
+            stats["hits"] += 1
+        return completion(body, content, f"chatcmpl-replay-{stats['requests']}")
+
+    @app.get("/stats")
+    async def get_stats():
+        return dict(stats)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve recorded judge responses from a local OpenAI-compatible API."
+    )
+    parser.add_argument("recordings", nargs="?", help="JSONL file written with --record.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay before every response.")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Up to this much extra delay, at random.")
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0,
+        help="Fraction of requests that fail with a 429 or 500 (default: 0).",
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=float,
+        default=None,
+        help="Retry-After seconds sent with injected 429s (default: none).",
+    )
+    parser.add_argument(
+        "--fallback",
+        default=None,
+        help="Reply with this text to requests that weren't recorded, instead of a 404.",
+    )
+    parser.add_argument("--seed", type=int, default=None, help="Seed for injected latency and errors.")
+    parser.add_argument("--batch-input", default=None, help="Answer this OpenAI batch input file instead of serving.")
+    parser.add_argument("--batch-output", default=None, help="Where to write the batch output file.")
+    args = parser.parse_args()
+
+    recordings = load_recordings(args.recordings) if args.recordings else {}
+    if args.batch_input:
+        if not args.batch_output:
+            parser.error("--batch-input needs --batch-output")
+        count = answer_batch(
+            recordings, args.batch_input, args.batch_output, args.fallback, args.error_rate, args.seed
+        )
+        print(f"Wrote {count} results to {args.batch_output}")
+        return
+    print(f"Serving {len(recordings)} recorded responses on http://{args.host}:{args.port}/v1")
+    app = create_app(
+        recordings,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        fallback=args.fallback,
+        seed=args.seed,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
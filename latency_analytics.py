@@ -0,0 +1,190 @@
+"""
+Vectorized latency stats for every session at once.
+
+`load_turns()` reads session_id, voice_to_voice_response_time, interrupted and
+turn_start_time into NumPy arrays in a single query. `session_stats()` sorts those
+arrays once, by session and then by voice-to-voice time, and finds the group boundaries.
+Every statistic for every session then comes from a handful of whole-array operations:
+counts, sums and minimums from `np.*.reduceat`, and percentiles by indexing straight into
+the sorted array. No Python code runs per session.
+"""
+
+import numpy as np
+
+TURN_COLUMNS = ("session_id", "voice_to_voice_response_time", "interrupted", "turn_start_time")
+
+TURNS_SQL = f"""
+    SELECT {', '.join(TURN_COLUMNS)}
+    FROM conversation_turn
+"""
+
+FETCH_SIZE = 50000
+
+
+class TurnArrays:
+    def __init__(self, session_ids, v2v, interrupted, turn_start_time):
+        self.session_ids = session_ids  # object array of str
+        self.v2v = v2v  # float64, NaN where the turn has no voice-to-voice time
+        self.interrupted = interrupted  # bool
+        self.turn_start_time = turn_start_time  # float64, unix seconds
+
+    def __len__(self):
+        return len(self.v2v)
+
+
+def load_turns(conn, where="", params=()):
+    session_ids = []
+    v2v = []
+    interrupted = []
+    turn_start_time = []
+    cursor = conn.execute(TURNS_SQL + where, params)
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        columns = list(zip(*rows))
+        session_ids.extend(columns[0])
+        v2v.extend(columns[1])
+        interrupted.extend(columns[2])
+        turn_start_time.extend(columns[3])
+    return TurnArrays(
+        np.array(session_ids, dtype=object),
+        # None becomes NaN
+        np.array(v2v, dtype=np.float64),
+        np.array(interrupted, dtype=bool),
+        np.array(turn_start_time, dtype=np.float64),
+    )
+
+
+def load_turns_parquet(out_dir):
+    """The same arrays as `load_turns()`, from the Parquet files turn_export.py writes."""
+    import turn_export
+
+    table = turn_export.load_turns(out_dir, columns=TURN_COLUMNS)
+    if table.num_rows == 0:
+        return TurnArrays(
+            np.array([], dtype=object),
+            np.array([], dtype=np.float64),
+            np.array([], dtype=bool),
+            np.array([], dtype=np.float64),
+        )
+    return TurnArrays(
+        table.column("session_id").to_numpy(),
+        # nulls become NaN
+        table.column("voice_to_voice_response_time").to_numpy(zero_copy_only=False),
+        table.column("interrupted").to_numpy(zero_copy_only=False).astype(bool),
+        table.column("turn_start_time").to_numpy(),
+    )
+
+
+class SessionStats:
+    def __init__(
+        self,
+        session_ids,
+        num_turns,
+        first_turn_start,
+        v2v_count,
+        v2v_mean,
+        v2v_percentiles,
+        interruption_rate,
+    ):
+        self.session_ids = session_ids
+        self.num_turns = num_turns
+        self.first_turn_start = first_turn_start
+        self.v2v_count = v2v_count
+        self.v2v_mean = v2v_mean  # NaN for sessions with no voice-to-voice times
+        self.v2v_percentiles = v2v_percentiles  # {percent: array}, NaN as above
+        self.interruption_rate = interruption_rate
+
+    def __len__(self):
+        return len(self.session_ids)
+
+
+def grouped_percentiles(values, starts, counts, percents):
+    """
+    Linear-interpolation percentiles (numpy's default method) for many groups at once.
+    Each group's values must be sorted and sit at values[starts[i]:starts[i] + counts[i]].
+    Groups with a count of 0 get NaN.
+    """
+    if len(values) == 0:
+        return {percent: np.full(len(starts), np.nan) for percent in percents}
+    result = {}
+    has_values = counts > 0
+    last = np.maximum(counts - 1, 0)
+    for percent in percents:
+        position = percent * last
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, last)
+        weight = position - lower
+        lower_values = values[starts + lower]
+        upper_values = values[starts + upper]
+        result[percent] = np.where(
+            has_values, lower_values * (1 - weight) + upper_values * weight, np.nan
+        )
+    return result
+
+
+def session_stats(turns, percents=(0.5, 0.95)):
+    if len(turns) == 0:
+        empty = np.array([], dtype=np.float64)
+        return SessionStats(
+            np.array([], dtype=object),
+            np.array([], dtype=np.int64),
+            empty,
+            np.array([], dtype=np.int64),
+            empty,
+            {percent: empty for percent in percents},
+            empty,
+        )
+
+    # Group by session: turn the IDs into integer codes, then sort by (code, v2v).
+    # lexsort puts NaN last within each session, so each session's valid
+    # voice-to-voice times come first and in order.
+    unique_ids, codes = np.unique(turns.session_ids, return_inverse=True)
+    order = np.lexsort((turns.v2v, codes))
+    codes = codes[order]
+    v2v = turns.v2v[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+
+    num_turns = np.diff(np.r_[starts, len(codes)])
+    valid = ~np.isnan(v2v)
+    v2v_count = np.add.reduceat(valid.astype(np.int64), starts)
+    v2v_sum = np.add.reduceat(np.where(valid, v2v, 0.0), starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        v2v_mean = np.where(v2v_count > 0, v2v_sum / v2v_count, np.nan)
+        interruption_rate = (
+            np.add.reduceat(turns.interrupted[order].astype(np.int64), starts) / num_turns
+        )
+
+    return SessionStats(
+        unique_ids,
+        num_turns,
+        np.minimum.reduceat(turns.turn_start_time[order], starts),
+        v2v_count,
+        v2v_mean,
+        grouped_percentiles(v2v, starts, v2v_count, percents),
+        interruption_rate,
+    )
+
+
+def overall_stats(turns, percents=(0.5, 0.95, 0.99)):
+    """Fleet-wide numbers over every turn, plus the spread of per-session medians."""
+    v2v = np.sort(turns.v2v[~np.isnan(turns.v2v)])
+    per_session = session_stats(turns, percents=(0.5,))
+    medians = np.sort(per_session.v2v_percentiles[0.5][per_session.v2v_count > 0])
+    zero = np.array([0])
+    return {
+        "sessions": len(per_session),
+        "turns": len(turns),
+        "turns_with_v2v": len(v2v),
+        "v2v_mean": float(v2v.mean()) if len(v2v) else None,
+        "v2v_percentiles": {
+            percent: float(value[0]) if len(v2v) else None
+            for percent, value in grouped_percentiles(v2v, zero, np.array([len(v2v)]), percents).items()
+        },
+        "interruption_rate": float(turns.interrupted.mean()) if len(turns) else None,
+        "session_median_percentiles": {
+            percent: float(value[0]) if len(medians) else None
+            for percent, value in grouped_percentiles(medians, zero, np.array([len(medians)]), percents).items()
+        },
+    }
@@ -0,0 +1,176 @@
+"""
+Mergeable voice-to-voice latency histograms, bucketed by time.
+
+Histograms use an HdrHistogram-style log-linear layout over whole milliseconds. Values
+below 2^SUB_BUCKET_BITS ms get their own bin. Above that, each power-of-two range is
+split into 2^(SUB_BUCKET_BITS - 1) equal bins, so any percentile we read back is within
+about 0.4% of the true value. Because every histogram uses the same bins, merging two of
+them just adds their counts. That works across time buckets, and across db files.
+
+The db keeps one histogram per BASE_BUCKET_SECONDS of turn start time, stored sparsely in
+the latency_histogram table (one row per non-empty bin). `refresh()` folds in only the
+turns added since the last refresh, tracked by a conversation_turn.id watermark. A report
+for any window and any bucket size (a multiple of the base) then merges stored
+histograms and never rescans the raw turns.
+
+Refreshing writes to the db, so reports don't do it; it runs as part of
+`analyze_conversations.py refresh-caches`. `behind()` says how stale a report is.
+"""
+
+import math
+import re
+from collections import Counter
+
+SUB_BUCKET_BITS = 8
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_SUB_BUCKETS = SUB_BUCKETS // 2
+
+BASE_BUCKET_SECONDS = 60
+
+
+def bin_index(seconds):
+    value = max(0, int(seconds * 1000))
+    if value < SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return SUB_BUCKETS + (shift - 1) * HALF_SUB_BUCKETS + ((value >> shift) - HALF_SUB_BUCKETS)
+
+
+def bin_value(index):
+    """The middle of a bin, in seconds."""
+    if index < SUB_BUCKETS:
+        return (index + 0.5) / 1000
+    shift = (index - SUB_BUCKETS) // HALF_SUB_BUCKETS + 1
+    top = (index - SUB_BUCKETS) % HALF_SUB_BUCKETS + HALF_SUB_BUCKETS
+    return ((top << shift) + ((1 << shift) - 1) / 2) / 1000
+
+
+class LatencyHistogram:
+    def __init__(self, counts=None):
+        self.counts = Counter(counts or {})
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def record(self, seconds, count=1):
+        self.counts[bin_index(seconds)] += count
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        return self
+
+    def percentile(self, percent):
+        """Nearest-rank percentile (percent in [0, 1]), in seconds. None if empty."""
+        total = self.total
+        if not total:
+            return None
+        rank = max(1, math.ceil(percent * total))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return bin_value(index)
+        return bin_value(max(self.counts))
+
+
+def parse_duration(text):
+    """'90s', '15m', '1h', '1d' -> seconds."""
+    match = re.fullmatch(r"(\d+)([smhd])", text.strip())
+    if not match:
+        raise ValueError(f"Bad duration {text!r}, expected something like 15m, 1h or 1d")
+    return int(match.group(1)) * {"s": 1, "m": 60, "h": 3600, "d": 86400}[match.group(2)]
+
+
+def refresh(conn):
+    """
+    Add turns inserted since the last refresh to the stored histograms. Returns the
+    number of turns added. Runs in one write transaction, so the histograms and the
+    watermark always move together.
+    """
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            watermark = conn.execute(
+                "SELECT last_turn_id FROM latency_histogram_state"
+            ).fetchone()[0]
+            new_watermark = conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM conversation_turn"
+            ).fetchone()[0]
+            counts = Counter()
+            added = 0
+            for turn_start, v2v in conn.execute(
+                """
+                SELECT turn_start_time, voice_to_voice_response_time
+                FROM conversation_turn
+                WHERE id > ? AND id <= ? AND voice_to_voice_response_time IS NOT NULL
+                """,
+                (watermark, new_watermark),
+            ):
+                bucket_start = int(turn_start) // BASE_BUCKET_SECONDS * BASE_BUCKET_SECONDS
+                counts[(bucket_start, bin_index(v2v))] += 1
+                added += 1
+            conn.executemany(
+                """
+                INSERT INTO latency_histogram (bucket_start, bin, count) VALUES (?, ?, ?)
+                ON CONFLICT (bucket_start, bin) DO UPDATE SET count = count + excluded.count
+                """,
+                ((bucket_start, index, count) for (bucket_start, index), count in counts.items()),
+            )
+            conn.execute(
+                "UPDATE latency_histogram_state SET last_turn_id = ?", (new_watermark,)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.isolation_level = isolation_level
+    return added
+
+
+def behind(conn):
+    """The number of turns with a voice-to-voice time that the stored histograms don't have yet."""
+    return conn.execute(
+        """
+        SELECT COUNT(*) FROM conversation_turn
+        WHERE id > (SELECT last_turn_id FROM latency_histogram_state)
+          AND voice_to_voice_response_time IS NOT NULL
+        """
+    ).fetchone()[0]
+
+
+def bucketed_histograms(conn, bucket_seconds, since=None, until=None):
+    """
+    Yield (bucket_start, LatencyHistogram) for each non-empty bucket of `bucket_seconds`
+    in the window, oldest first, by merging the stored base histograms.
+    """
+    if bucket_seconds % BASE_BUCKET_SECONDS:
+        raise ValueError(f"Bucket size must be a multiple of {BASE_BUCKET_SECONDS}s")
+    cursor = conn.execute(
+        """
+        SELECT bucket_start / :bucket * :bucket AS bucket, bin, SUM(count)
+        FROM latency_histogram
+        WHERE bucket_start >= :since AND bucket_start < :until
+        GROUP BY bucket, bin
+        ORDER BY bucket
+        """,
+        {
+            "bucket": bucket_seconds,
+            "since": int(since) if since is not None else 0,
+            "until": int(until) if until is not None else 2**62,
+        },
+    )
+    current = None
+    histogram = None
+    for bucket, index, count in cursor:
+        if bucket != current:
+            if histogram is not None:
+                yield current, histogram
+            current = bucket
+            histogram = LatencyHistogram()
+        histogram.counts[index] += count
+    if histogram is not None:
+        yield current, histogram
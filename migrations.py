@@ -0,0 +1,349 @@
+"""
+Versioned schema migrations for the conversation turns db.
+
+PRAGMA user_version holds the number of the last migration applied. Each migration runs
+in its own BEGIN IMMEDIATE transaction, so a bot and an analysis script starting at the
+same time can't both apply the same one.
+
+Run this file directly to bring a db file up to date:
+
+    python migrations.py [--db path/to/conversation_turns.db]
+"""
+
+import argparse
+import os
+import sqlite3
+
+DB_PATH = os.path.join(
+    os.path.dirname(__file__), "db-and-recordings/conversation_turns.db"
+)
+
+MIGRATIONS = [
+    # 1: the original table, as created by hand from the README
+    """
+    CREATE TABLE IF NOT EXISTS conversation_turn (
+      session_id TEXT NOT NULL,
+      turn_number INTEGER NOT NULL,
+      turn_start_time REAL NOT NULL,
+      turn_end_time REAL NOT NULL,
+      user_speech_text TEXT,
+      llm_response_text TEXT,
+      voice_to_voice_response_time REAL,
+      interrupted BOOLEAN NOT NULL
+    );
+    """,
+    # 2: give turns a stable id and a (session_id, turn_number) key, and keep a
+    # per-session summary row up to date from a trigger, so it is written in the same
+    # transaction as the turn itself. If a turn was saved twice, the first copy wins.
+    """
+    CREATE TABLE conversation_turn_new (
+      id INTEGER PRIMARY KEY,
+      session_id TEXT NOT NULL,
+      turn_number INTEGER NOT NULL,
+      turn_start_time REAL NOT NULL,  -- seconds since Unix epoch, as returned by time.time()
+      turn_end_time REAL NOT NULL,    -- seconds since Unix epoch, as returned by time.time()
+      user_speech_text TEXT,
+      llm_response_text TEXT,
+      voice_to_voice_response_time REAL,
+      interrupted BOOLEAN NOT NULL,
+      UNIQUE (session_id, turn_number)
+    );
+    INSERT OR IGNORE INTO conversation_turn_new (
+      id, session_id, turn_number, turn_start_time, turn_end_time, user_speech_text,
+      llm_response_text, voice_to_voice_response_time, interrupted
+    )
+    SELECT
+      rowid, session_id, turn_number, turn_start_time, turn_end_time, user_speech_text,
+      llm_response_text, voice_to_voice_response_time, interrupted
+    FROM conversation_turn
+    ORDER BY rowid;
+    DROP TABLE conversation_turn;
+    ALTER TABLE conversation_turn_new RENAME TO conversation_turn;
+
+    CREATE TABLE session (
+      session_id TEXT PRIMARY KEY,
+      first_turn_start_time REAL NOT NULL,
+      num_turns INTEGER NOT NULL DEFAULT 0,
+      v2v_count INTEGER NOT NULL DEFAULT 0,
+      v2v_sum REAL NOT NULL DEFAULT 0,
+      v2v_min REAL,
+      v2v_max REAL,
+      num_interrupted INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX session_by_first_turn_start_time ON session (first_turn_start_time);
+    INSERT INTO session
+    SELECT
+      session_id,
+      MIN(turn_start_time),
+      COUNT(*),
+      COUNT(voice_to_voice_response_time),
+      COALESCE(SUM(voice_to_voice_response_time), 0),
+      MIN(voice_to_voice_response_time),
+      MAX(voice_to_voice_response_time),
+      SUM(interrupted != 0)
+    FROM conversation_turn
+    GROUP BY session_id;
+
+    CREATE TRIGGER conversation_turn_update_session AFTER INSERT ON conversation_turn
+    BEGIN
+      INSERT OR IGNORE INTO session (session_id, first_turn_start_time)
+      VALUES (NEW.session_id, NEW.turn_start_time);
+      UPDATE session SET
+        first_turn_start_time = MIN(first_turn_start_time, NEW.turn_start_time),
+        num_turns = num_turns + 1,
+        v2v_count = v2v_count + (NEW.voice_to_voice_response_time IS NOT NULL),
+        v2v_sum = v2v_sum + COALESCE(NEW.voice_to_voice_response_time, 0),
+        v2v_min = CASE
+          WHEN NEW.voice_to_voice_response_time IS NULL THEN v2v_min
+          WHEN v2v_min IS NULL OR NEW.voice_to_voice_response_time < v2v_min
+            THEN NEW.voice_to_voice_response_time
+          ELSE v2v_min
+        END,
+        v2v_max = CASE
+          WHEN NEW.voice_to_voice_response_time IS NULL THEN v2v_max
+          WHEN v2v_max IS NULL OR NEW.voice_to_voice_response_time > v2v_max
+            THEN NEW.voice_to_voice_response_time
+          ELSE v2v_max
+        END,
+        num_interrupted = num_interrupted + (NEW.interrupted != 0)
+      WHERE session_id = NEW.session_id;
+    END;
+    """,
+    # 3: where each turn sits in the conversation recording, as sample offsets counted
+    # at audio_sample_rate. NULL for turns saved before this existed.
+    """
+    ALTER TABLE conversation_turn ADD COLUMN audio_start_sample INTEGER;
+    ALTER TABLE conversation_turn ADD COLUMN audio_end_sample INTEGER;
+    ALTER TABLE conversation_turn ADD COLUMN audio_sample_rate INTEGER;
+    """,
+    # 4: per-stage latency breakdown for each turn, from the pipeline's monotonic clock.
+    # Nanoseconds relative to the user's VAD stop (vad_stop_ns is 0). Turns with no user
+    # speech (the greeting) are relative to their earliest stage, and vad_stop_ns is NULL.
+    """
+    CREATE TABLE turn_stage_timing (
+      session_id TEXT NOT NULL,
+      turn_number INTEGER NOT NULL,
+      vad_stop_ns INTEGER,
+      stt_final_ns INTEGER,
+      llm_first_token_ns INTEGER,
+      tts_first_audio_ns INTEGER,
+      first_audio_out_ns INTEGER,
+      PRIMARY KEY (session_id, turn_number)
+    );
+    """,
+    # 5: Pipecat service metrics (TTFB and processing seconds, LLM tokens, TTS
+    # characters), one narrow row per value so new metrics don't need new columns.
+    # turn_number is NULL for metrics that arrived after the session's last turn ended.
+    """
+    CREATE TABLE service_metric (
+      session_id TEXT NOT NULL,
+      turn_number INTEGER,
+      service TEXT NOT NULL,
+      model TEXT,
+      metric TEXT NOT NULL,
+      value REAL NOT NULL
+    );
+    CREATE INDEX service_metric_by_turn ON service_metric (session_id, turn_number);
+    CREATE INDEX service_metric_by_metric ON service_metric (metric, service);
+    """,
+    # 6: covering index for per-session latency percentiles. A scan of it returns every
+    # session's turns already sorted by voice-to-voice time.
+    """
+    CREATE INDEX conversation_turn_by_session_v2v
+    ON conversation_turn (session_id, voice_to_voice_response_time, turn_start_time);
+    """,
+    # 7: voice-to-voice histograms per minute of turn start time (see
+    # latency_histogram.py), plus the conversation_turn.id they are up to date with.
+    """
+    CREATE TABLE latency_histogram (
+      bucket_start INTEGER NOT NULL,  -- unix seconds, a multiple of the base bucket size
+      bin INTEGER NOT NULL,
+      count INTEGER NOT NULL,
+      PRIMARY KEY (bucket_start, bin)
+    ) WITHOUT ROWID;
+    CREATE TABLE latency_histogram_state (
+      last_turn_id INTEGER NOT NULL
+    );
+    INSERT INTO latency_histogram_state (last_turn_id) VALUES (0);
+    """,
+    # 8: cached per-session voice-to-voice percentiles (see stats_cache.py), and for
+    # each percentile the conversation_turn.id the cache is up to date with.
+    """
+    CREATE TABLE session_percentile (
+      session_id TEXT NOT NULL,
+      percent REAL NOT NULL,
+      v2v REAL,
+      PRIMARY KEY (session_id, percent)
+    ) WITHOUT ROWID;
+    CREATE TABLE session_percentile_state (
+      percent REAL PRIMARY KEY,
+      last_turn_id INTEGER NOT NULL
+    );
+    """,
+    # 9: full-text index over both sides of each turn's transcript. It is an external
+    # content table, so the text is stored once, in conversation_turn, and the triggers
+    # keep the index in step with it.
+    """
+    CREATE VIRTUAL TABLE conversation_turn_fts USING fts5(
+      user_speech_text,
+      llm_response_text,
+      content='conversation_turn',
+      content_rowid='id',
+      tokenize='porter unicode61'
+    );
+    INSERT INTO conversation_turn_fts (conversation_turn_fts) VALUES ('rebuild');
+
+    CREATE TRIGGER conversation_turn_fts_insert AFTER INSERT ON conversation_turn
+    BEGIN
+      INSERT INTO conversation_turn_fts (rowid, user_speech_text, llm_response_text)
+      VALUES (NEW.id, NEW.user_speech_text, NEW.llm_response_text);
+    END;
+    CREATE TRIGGER conversation_turn_fts_delete AFTER DELETE ON conversation_turn
+    BEGIN
+      INSERT INTO conversation_turn_fts (conversation_turn_fts, rowid, user_speech_text, llm_response_text)
+      VALUES ('delete', OLD.id, OLD.user_speech_text, OLD.llm_response_text);
+    END;
+    CREATE TRIGGER conversation_turn_fts_update AFTER UPDATE OF user_speech_text, llm_response_text ON conversation_turn
+    BEGIN
+      INSERT INTO conversation_turn_fts (conversation_turn_fts, rowid, user_speech_text, llm_response_text)
+      VALUES ('delete', OLD.id, OLD.user_speech_text, OLD.llm_response_text);
+      INSERT INTO conversation_turn_fts (rowid, user_speech_text, llm_response_text)
+      VALUES (NEW.id, NEW.user_speech_text, NEW.llm_response_text);
+    END;
+    """,
+    # 10: response timing measured from the stereo recording by audio_analysis.py.
+    # Seconds; user_stop_s and bot_start_s are offsets into the recording.
+    """
+    CREATE TABLE turn_audio_timing (
+      session_id TEXT NOT NULL,
+      turn_number INTEGER NOT NULL,
+      user_stop_s REAL,
+      bot_start_s REAL,
+      response_gap_s REAL,
+      overlap_s REAL NOT NULL,
+      barge_in_s REAL,
+      bot_stop_after_barge_in_s REAL,
+      PRIMARY KEY (session_id, turn_number)
+    );
+    """,
+    # 11: LLM judge responses, keyed by a hash of everything that goes into the request
+    # (see judge_client.JudgeCache).
+    """
+    CREATE TABLE judge_cache (
+      key TEXT PRIMARY KEY,
+      model TEXT NOT NULL,
+      response TEXT NOT NULL,
+      created_at REAL NOT NULL
+    ) WITHOUT ROWID;
+    """,
+    # 12: per-turn verdicts from evals.py. passed is NULL for evals that don't have a
+    # pass/fail answer; detail is the judge's explanation.
+    """
+    CREATE TABLE eval_result (
+      eval_name TEXT NOT NULL,
+      turn_id INTEGER NOT NULL REFERENCES conversation_turn (id),
+      passed BOOLEAN,
+      detail TEXT,
+      model TEXT NOT NULL,
+      created_at REAL NOT NULL,
+      PRIMARY KEY (eval_name, turn_id)
+    ) WITHOUT ROWID;
+    """,
+    # 13: history of check_first_turn_greeting.py runs and their verdicts. A run is
+    # completed once finished_at is set; last_turn_id is the newest conversation_turn
+    # it considered, so the next --since run can start after it.
+    """
+    CREATE TABLE eval_run (
+      id INTEGER PRIMARY KEY,
+      eval_name TEXT NOT NULL,
+      prompt_hash TEXT NOT NULL,
+      model TEXT NOT NULL,
+      started_at REAL NOT NULL,
+      finished_at REAL,
+      last_turn_id INTEGER NOT NULL,
+      since TEXT,
+      num_judged INTEGER,
+      num_passed INTEGER,
+      num_errors INTEGER
+    );
+    CREATE INDEX eval_run_by_eval ON eval_run (eval_name, prompt_hash, model, id);
+    CREATE TABLE eval_run_verdict (
+      run_id INTEGER NOT NULL REFERENCES eval_run (id),
+      session_id TEXT NOT NULL,
+      verdict TEXT,  -- NULL when the judge request failed
+      tier TEXT,
+      PRIMARY KEY (run_id, session_id)
+    ) WITHOUT ROWID;
+    """,
+    # 14: nothing reads turn_start_time from the per-session v2v index any more
+    # (list-sessions --show-percentiles takes each session's start from the session
+    # table), so it was only making the index bigger.
+    """
+    DROP INDEX conversation_turn_by_session_v2v;
+    CREATE INDEX conversation_turn_by_session_v2v
+    ON conversation_turn (session_id, voice_to_voice_response_time);
+    """,
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _statements(script):
+    # Split on ';' but let sqlite decide where a statement really ends, so the
+    # semicolons inside CREATE TRIGGER ... BEGIN ... END stay together.
+    statement = ""
+    for piece in script.split(";"):
+        statement += piece + ";"
+        if sqlite3.complete_statement(statement):
+            if statement.strip(" \n;"):
+                yield statement
+            statement = ""
+
+
+def migrate(conn):
+    """Apply any migrations this db hasn't seen yet. Returns the resulting version."""
+    if schema_version(conn) >= LATEST_VERSION:
+        return schema_version(conn)
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        for version, script in enumerate(MIGRATIONS, start=1):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # check again now that we hold the write lock
+                if schema_version(conn) < version:
+                    for statement in _statements(script):
+                        conn.execute(statement)
+                    conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    finally:
+        conn.isolation_level = isolation_level
+    return schema_version(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Create or upgrade the conversation turns db schema."
+    )
+    parser.add_argument("--db", default=DB_PATH, help="Path to the sqlite db file.")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    before = schema_version(conn)
+    after = migrate(conn)
+    conn.close()
+    if before == after:
+        print(f"{args.db} is up to date (version {after}).")
+    else:
+        print(f"Migrated {args.db} from version {before} to {after}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 import argparse
+import pathlib
 import sqlite3
-import wave
 import pyaudio
 import os
 
+from recording import SAMPLE_WIDTH, read_turn_audio
+from recording_archive import RecordingArchive, archive_path
+
 DB_PATH = os.path.join("db-and-recordings", "conversation_turns.db")
 AUDIO_DIR = "db-and-recordings"
 
@@ -14,63 +17,92 @@ PLAY_PADDING = 1.0
 
 
 def get_turn_times(session_id, turn_number):
-    conn = sqlite3.connect(DB_PATH)
+    # read-only and no migration, so playing a turn never writes to or locks a live db
+    conn = sqlite3.connect(pathlib.Path(DB_PATH).resolve().as_uri() + "?mode=ro", uri=True)
     c = conn.cursor()
-    # Get the first turn's start time for this session
-    c.execute(
-        """SELECT turn_start_time FROM conversation_turn WHERE session_id=? ORDER BY turn_number ASC LIMIT 1""",
-        (session_id,),
-    )
-    row = c.fetchone()
-    if not row:
-        raise ValueError(f"No turns found for session_id {session_id}")
-    session_start = row[0]
-    # Get the requested turn's start and end time
     c.execute(
-        """SELECT turn_start_time, turn_end_time FROM conversation_turn WHERE session_id=? AND turn_number=?""",
+        """
+        SELECT
+          audio_start_sample,
+          audio_end_sample,
+          audio_sample_rate,
+          turn_start_time,
+          turn_end_time,
+          (SELECT first_turn_start_time FROM session WHERE session_id = t.session_id)
+        FROM conversation_turn t
+        WHERE session_id = ? AND turn_number = ?
+        """,
         (session_id, turn_number),
     )
     row = c.fetchone()
+    conn.close()
     if not row:
         raise ValueError(f"Turn {turn_number} not found for session_id {session_id}")
-    turn_start, turn_end = row
-    conn.close()
-    # Offset relative to session start
+    start_sample, end_sample, sample_rate, turn_start, turn_end, session_start = row
+    if start_sample is not None:
+        # The bot recorded exactly where this turn sits in the recording.
+        turn_start_sec = start_sample / sample_rate
+        turn_end_sec = end_sample / sample_rate
+    else:
+        # Turns saved before that only have wall-clock times, so estimate the offset
+        # from the start of the session's first turn.
+        turn_start_sec = turn_start - session_start
+        turn_end_sec = turn_end - session_start
     return (
-        max(0, turn_start - session_start - PLAY_PADDING),
-        turn_end - session_start + PLAY_PADDING,
+        max(0, turn_start_sec - PLAY_PADDING),
+        turn_end_sec + PLAY_PADDING,
     )
 
 
 def play_wav_segment(wav_path, start_sec, end_sec, chunk_ms=100):
     print(f"Playing {wav_path} from {start_sec:.2f}s to {end_sec:.2f}s")
-    with wave.open(wav_path, "rb") as wf:
-        framerate = wf.getframerate()
-        sampwidth = wf.getsampwidth()
-        nchannels = wf.getnchannels()
-        start_frame = int(start_sec * framerate)
-        end_frame = int(end_sec * framerate)
-        nframes = end_frame - start_frame
-        wf.setpos(start_frame)
+    # offsets in milliseconds; read_turn_audio converts them to the file's sample rate
+    # and slices the turn out of an mmap of the file
+    data, framerate, nchannels = read_turn_audio(
+        wav_path, int(start_sec * 1000), int(end_sec * 1000), 1000
+    )
+    chunk_bytes = int((chunk_ms / 1000.0) * framerate) * nchannels * SAMPLE_WIDTH
 
-        chunk_frames = int((chunk_ms / 1000.0) * framerate)
+    p = pyaudio.PyAudio()
+    stream = p.open(
+        format=p.get_format_from_width(SAMPLE_WIDTH),
+        channels=nchannels,
+        rate=framerate,
+        output=True,
+    )
+    try:
+        for offset in range(0, len(data), chunk_bytes):
+            stream.write(data[offset : offset + chunk_bytes])
+    except KeyboardInterrupt:
+        print("\nPlayback interrupted by user.")
+    finally:
+        stream.stop_stream()
+        stream.close()
+        p.terminate()
+
+
+def play_archive_segment(path, start_sec, end_sec, chunk_ms=100):
+    print(f"Playing {path} from {start_sec:.2f}s to {end_sec:.2f}s")
+    with RecordingArchive(path) as archive:
+        framerate = archive.sample_rate
+        # only the archive chunks that cover this turn get decoded
+        data = archive.read_frames(int(start_sec * framerate), int(end_sec * framerate))
+        chunk_bytes = (
+            int((chunk_ms / 1000.0) * framerate)
+            * archive.num_channels
+            * archive.sample_width
+        )
 
         p = pyaudio.PyAudio()
         stream = p.open(
-            format=p.get_format_from_width(sampwidth),
-            channels=nchannels,
+            format=p.get_format_from_width(archive.sample_width),
+            channels=archive.num_channels,
             rate=framerate,
             output=True,
         )
-        frames_left = nframes
         try:
-            while frames_left > 0:
-                frames_to_read = min(chunk_frames, frames_left)
-                data = wf.readframes(frames_to_read)
-                if not data:
-                    break
-                stream.write(data)
-                frames_left -= frames_to_read
+            for offset in range(0, len(data), chunk_bytes):
+                stream.write(data[offset : offset + chunk_bytes])
         except KeyboardInterrupt:
             print("\nPlayback interrupted by user.")
         finally:
@@ -88,7 +120,13 @@ def main():
     args = parser.parse_args()
 
     wav_path = os.path.join(AUDIO_DIR, f"conversation-{args.session_id}.wav")
-    if not os.path.exists(wav_path):
+    if os.path.exists(wav_path):
+        play_segment = play_wav_segment
+        audio_path = wav_path
+    elif os.path.exists(archive_path(wav_path)):
+        play_segment = play_archive_segment
+        audio_path = archive_path(wav_path)
+    else:
         raise FileNotFoundError(f"Audio file not found: {wav_path}")
 
     start_sec, end_sec = get_turn_times(args.session_id, args.turn_number)
@@ -96,7 +134,7 @@ def main():
         f"Playing session {args.session_id} turn {args.turn_number} ({start_sec:.2f}s - {end_sec:.2f}s)"
     )
     try:
-        play_wav_segment(wav_path, start_sec, end_sec)
+        play_segment(audio_path, start_sec, end_sec)
     except KeyboardInterrupt:
         print("\nPlayback interrupted by user.")
         return
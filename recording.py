@@ -0,0 +1,182 @@
+#
+# Copyright (c) 2025, Daily
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+"""
+Streams conversation audio to a WAV file on disk while the call is running.
+
+The bot's AudioBufferProcessor hands us a fixed-size chunk of audio every time its
+buffer fills up. We append each chunk to the file, so memory use doesn't depend on how
+long the call is. The RIFF and data chunk sizes in the header are only known at the end.
+Until then they are written as 0 and `close()` fills them in.
+
+If the bot dies before `close()`, the audio is on disk but the header still says 0
+bytes. Repair those files with:
+
+    python recording.py repair [files...]
+"""
+
+import argparse
+import glob
+import mmap
+import os
+import struct
+from typing import Optional, Tuple
+
+import aiofiles
+
+AUDIO_DIR = "db-and-recordings"
+
+SAMPLE_WIDTH = 2  # 16-bit PCM
+WAV_HEADER_SIZE = 44
+
+
+def wav_header(sample_rate: int, num_channels: int, data_size: int) -> bytes:
+    block_align = num_channels * SAMPLE_WIDTH
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + data_size,
+        b"WAVE",
+        b"fmt ",
+        16,  # fmt chunk size
+        1,  # PCM
+        num_channels,
+        sample_rate,
+        sample_rate * block_align,  # byte rate
+        block_align,
+        SAMPLE_WIDTH * 8,
+        b"data",
+        data_size,
+    )
+
+
+class StreamingWavRecorder:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._format: Optional[Tuple[int, int]] = None
+        self._data_size = 0
+
+    @property
+    def bytes_written(self) -> int:
+        return self._data_size
+
+    async def write(self, audio: bytes, sample_rate: int, num_channels: int):
+        if self._file is None:
+            self._format = (sample_rate, num_channels)
+            self._file = await aiofiles.open(self.path, "wb")
+            await self._file.write(wav_header(sample_rate, num_channels, 0))
+        elif self._format != (sample_rate, num_channels):
+            raise ValueError(
+                f"Audio format changed mid-recording from {self._format} to {(sample_rate, num_channels)}"
+            )
+        await self._file.write(audio)
+        # get each chunk to the OS now, so a crash loses at most the chunk in flight
+        await self._file.flush()
+        self._data_size += len(audio)
+
+    async def close(self):
+        if self._file is None:
+            return
+        sample_rate, num_channels = self._format
+        await self._file.seek(0)
+        await self._file.write(wav_header(sample_rate, num_channels, self._data_size))
+        await self._file.close()
+        self._file = None
+
+
+def parse_wav_header(header: bytes, path: str) -> Tuple[int, int, int, int, int]:
+    """
+    Return (riff_size, num_channels, sample_rate, block_align, data_size) from the first
+    WAV_HEADER_SIZE bytes of a recording. Raises ValueError for anything else.
+    """
+    # Our recordings (and the ones the wave module wrote before them) always use the
+    # canonical 44-byte layout, so every field is at a fixed offset.
+    if (
+        len(header) < WAV_HEADER_SIZE
+        or header[0:4] != b"RIFF"
+        or header[8:16] != b"WAVEfmt "
+        or header[36:40] != b"data"
+    ):
+        raise ValueError(f"{path} doesn't look like a recording written by this bot")
+    riff_size = struct.unpack_from("<I", header, 4)[0]
+    num_channels, sample_rate = struct.unpack_from("<HI", header, 22)
+    block_align = struct.unpack_from("<H", header, 32)[0]
+    data_size = struct.unpack_from("<I", header, 40)[0]
+    return riff_size, num_channels, sample_rate, block_align, data_size
+
+
+def read_turn_audio(
+    wav_path: str, start_sample: int, end_sample: int, sample_rate: int
+) -> Tuple[bytes, int, int]:
+    """
+    Return the PCM bytes for [start_sample, end_sample) of a recording, plus its sample
+    rate and channel count. Offsets are counted at `sample_rate` (the audio_sample_rate
+    stored with each turn) and converted to the file's rate. The bytes are sliced
+    straight out of an mmap of the file, so nothing before the turn is read.
+    """
+    with open(wav_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            _, num_channels, file_rate, block_align, data_size = parse_wav_header(
+                m[:WAV_HEADER_SIZE], wav_path
+            )
+            # a recording that was never closed still says 0 bytes of data
+            available = len(m) - WAV_HEADER_SIZE
+            data_end = WAV_HEADER_SIZE + (min(data_size, available) if data_size else available)
+            start = WAV_HEADER_SIZE + start_sample * file_rate // sample_rate * block_align
+            end = WAV_HEADER_SIZE + end_sample * file_rate // sample_rate * block_align
+            return m[min(start, data_end) : min(end, data_end)], file_rate, num_channels
+
+
+def repair_wav(path: str) -> bool:
+    """
+    Fix the header sizes of a WAV file left behind by a recorder that never closed.
+    Any partial sample frame at the end is dropped. Returns True if the file changed.
+    """
+    with open(path, "r+b") as f:
+        riff_size, num_channels, sample_rate, block_align, data_size = parse_wav_header(
+            f.read(WAV_HEADER_SIZE), path
+        )
+        actual_data_size = os.fstat(f.fileno()).st_size - WAV_HEADER_SIZE
+        actual_data_size -= actual_data_size % block_align
+        if data_size == actual_data_size and riff_size == 36 + actual_data_size:
+            return False
+        f.truncate(WAV_HEADER_SIZE + actual_data_size)
+        f.seek(0)
+        f.write(wav_header(sample_rate, num_channels, actual_data_size))
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conversation recording tools.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_repair = subparsers.add_parser(
+        "repair", help="Fix the headers of recordings that were never closed."
+    )
+    parser_repair.add_argument(
+        "files",
+        nargs="*",
+        help=f"WAV files to repair. Defaults to every recording in {AUDIO_DIR}/.",
+    )
+    args = parser.parse_args()
+
+    if args.command == "repair":
+        files = args.files or sorted(
+            glob.glob(os.path.join(AUDIO_DIR, "conversation-*.wav"))
+        )
+        repaired = 0
+        for path in files:
+            try:
+                if repair_wav(path):
+                    repaired += 1
+                    print(f"Repaired {path}")
+            except ValueError as e:
+                print(f"Skipping: {e}")
+        print(f"Checked {len(files)} files, repaired {repaired}.")
+
+
+if __name__ == "__main__":
+    main()
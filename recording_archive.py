@@ -0,0 +1,253 @@
+"""
+Compressed, seekable archive format for conversation recordings.
+
+A .vca file is a recording cut into fixed-length chunks. Each chunk is encoded as its
+own small FLAC stream, and a seek table sits up front:
+
+    header      magic "VCA1", sample rate, channels, frames per chunk, total frames,
+                chunk count
+    seek table  one (byte offset, byte length) entry per chunk
+    chunks      FLAC streams, back to back
+
+To play or export a turn, we read the seek table and decode only the chunks that cover
+the turn.
+
+Encode the recordings in db-and-recordings/ (after their sessions have ended) with:
+
+    python recording_archive.py encode [--workers N] [--delete-wav] [files...]
+
+Recordings whose header says they are empty are skipped. That's the state a recording is
+in while its call is still running (see recording.py).
+
+Needs the soundfile package (libsndfile) for FLAC.
+"""
+
+import argparse
+import glob
+import io
+import os
+import struct
+import sys
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+
+AUDIO_DIR = "db-and-recordings"
+ARCHIVE_EXTENSION = ".vca"
+
+MAGIC = b"VCA1"
+HEADER = struct.Struct("<4sIHIQI")
+SEEK_ENTRY = struct.Struct("<QI")
+
+# Ten seconds per chunk keeps the seek table tiny and still lets us decode a turn
+# without touching the rest of the call.
+CHUNK_SECONDS = 10
+
+
+def _soundfile():
+    try:
+        import soundfile
+    except ImportError:
+        raise RuntimeError(
+            "Recording archives need the soundfile package: pip install soundfile"
+        )
+    return soundfile
+
+
+def archive_path(wav_path):
+    return os.path.splitext(wav_path)[0] + ARCHIVE_EXTENSION
+
+
+def _encode_chunk(pcm, sample_rate, num_channels):
+    import numpy as np
+
+    samples = np.frombuffer(pcm, dtype="<i2").reshape(-1, num_channels)
+    buffer = io.BytesIO()
+    _soundfile().write(buffer, samples, sample_rate, format="FLAC", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+def _decode_chunk(blob):
+    samples, _ = _soundfile().read(io.BytesIO(blob), dtype="int16", always_2d=True)
+    return samples.astype("<i2", copy=False).tobytes()
+
+
+def encode_wav(wav_path, delete_wav=False):
+    """
+    Encode one WAV recording into a .vca archive next to it. Only one chunk is held in
+    memory at a time. Returns a dict of stats, or None if the recording was skipped.
+    """
+    start = time.perf_counter()
+    with wave.open(wav_path, "rb") as wf:
+        sample_rate = wf.getframerate()
+        num_channels = wf.getnchannels()
+        total_frames = wf.getnframes()
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"{wav_path}: only 16-bit recordings can be archived")
+        if total_frames == 0:
+            return None
+        chunk_frames = sample_rate * CHUNK_SECONDS
+        num_chunks = (total_frames + chunk_frames - 1) // chunk_frames
+
+        out_path = archive_path(wav_path)
+        tmp_path = out_path + ".tmp"
+        seek_table = []
+        try:
+            with open(tmp_path, "wb") as out:
+                table_start = HEADER.size
+                out.seek(table_start + SEEK_ENTRY.size * num_chunks)
+                for _ in range(num_chunks):
+                    blob = _encode_chunk(
+                        wf.readframes(chunk_frames), sample_rate, num_channels
+                    )
+                    seek_table.append((out.tell(), len(blob)))
+                    out.write(blob)
+                archive_bytes = out.tell()
+                out.seek(0)
+                out.write(
+                    HEADER.pack(
+                        MAGIC,
+                        sample_rate,
+                        num_channels,
+                        chunk_frames,
+                        total_frames,
+                        num_chunks,
+                    )
+                )
+                for entry in seek_table:
+                    out.write(SEEK_ENTRY.pack(*entry))
+        except Exception:
+            # don't leave a half-written archive behind
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, out_path)
+
+    wav_bytes = os.path.getsize(wav_path)
+    if delete_wav:
+        os.remove(wav_path)
+    return {
+        "wav_path": wav_path,
+        "archive_path": out_path,
+        "audio_seconds": total_frames / sample_rate,
+        "wav_bytes": wav_bytes,
+        "archive_bytes": archive_bytes,
+        "encode_seconds": time.perf_counter() - start,
+    }
+
+
+class RecordingArchive:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        (
+            magic,
+            self.sample_rate,
+            self.num_channels,
+            self.chunk_frames,
+            self.total_frames,
+            num_chunks,
+        ) = HEADER.unpack(self._file.read(HEADER.size))
+        if magic != MAGIC:
+            self._file.close()
+            raise ValueError(f"{path} is not a recording archive")
+        table = self._file.read(SEEK_ENTRY.size * num_chunks)
+        self._seek_table = list(SEEK_ENTRY.iter_unpack(table))
+
+    @property
+    def sample_width(self):
+        return 2
+
+    def read_frames(self, start_frame, end_frame):
+        """Return 16-bit PCM for [start_frame, end_frame), decoding only the chunks needed."""
+        start_frame = max(0, start_frame)
+        end_frame = min(end_frame, self.total_frames)
+        if end_frame <= start_frame:
+            return b""
+        first_chunk = start_frame // self.chunk_frames
+        last_chunk = (end_frame - 1) // self.chunk_frames
+        pcm = bytearray()
+        for offset, length in self._seek_table[first_chunk : last_chunk + 1]:
+            self._file.seek(offset)
+            pcm += _decode_chunk(self._file.read(length))
+        block_align = self.num_channels * self.sample_width
+        skip = (start_frame - first_chunk * self.chunk_frames) * block_align
+        return bytes(pcm[skip : skip + (end_frame - start_frame) * block_align])
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def encode_all(wav_paths, workers=None, delete_wav=False):
+    """
+    Encode recordings in a process pool. Yields stats for each one that was encoded. A
+    recording that can't be encoded (truncated, not 16-bit, unreadable) is reported and
+    skipped, and the rest are still encoded.
+    """
+    _soundfile()  # a missing package fails once, not once per file
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(encode_wav, path, delete_wav) for path in wav_paths]
+        for path, future in zip(wav_paths, futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Skipping {path}: {e!r}", file=sys.stderr)
+                continue
+            if result is not None:
+                yield result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compressed recording archives.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_encode = subparsers.add_parser(
+        "encode", help="Encode WAV recordings into seekable .vca archives."
+    )
+    parser_encode.add_argument(
+        "files",
+        nargs="*",
+        help=f"WAV files to encode. Defaults to every recording in {AUDIO_DIR}/ that has no archive yet.",
+    )
+    parser_encode.add_argument(
+        "--workers", type=int, default=None, help="Encoder processes (default: CPU count)."
+    )
+    parser_encode.add_argument(
+        "--delete-wav",
+        action="store_true",
+        help="Delete each WAV file once its archive has been written.",
+    )
+    args = parser.parse_args()
+
+    if args.command == "encode":
+        files = args.files or [
+            path
+            for path in sorted(glob.glob(os.path.join(AUDIO_DIR, "conversation-*.wav")))
+            if not os.path.exists(archive_path(path))
+        ]
+        total_wav = total_archive = 0
+        start = time.perf_counter()
+        for result in encode_all(files, args.workers, args.delete_wav):
+            total_wav += result["wav_bytes"]
+            total_archive += result["archive_bytes"]
+            print(
+                f"{result['archive_path']}: {result['audio_seconds']:.1f}s of audio, "
+                f"{result['wav_bytes'] / 1e6:.1f} MB -> {result['archive_bytes'] / 1e6:.1f} MB"
+            )
+        elapsed = time.perf_counter() - start
+        if total_wav:
+            print(
+                f"Encoded {total_wav / 1e6:.1f} MB -> {total_archive / 1e6:.1f} MB "
+                f"({total_archive / total_wav:.1%}) in {elapsed:.1f}s"
+            )
+        else:
+            print("Nothing to encode.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Fleet-wide stats over many conversation dbs at once.
+
+Each bot host writes its own conversation_turns.db. `fleet_summary()` opens every shard
+in its own worker process, reduces it to a small summary that can be merged with the
+others, then merges them all:
+
+- counts and sums from the session table
+- a voice-to-voice LatencyHistogram: the shard's stored histograms, plus any turns
+  latency_histogram.refresh() hasn't folded in yet
+- the shard's top-k slowest turns
+
+Shards are opened read-only, so summarizing a live bot's db never writes to it or
+takes its write lock. A shard has to be at least at HISTOGRAM_VERSION; migrate older
+ones first (`python migrations.py`).
+
+Only those summaries cross process boundaries, so the work scales with the number of
+cores, and the merged report is the same as one built from a single db holding every
+turn (up to the histogram's ~0.4% percentile error).
+"""
+
+import heapq
+import pathlib
+import sqlite3
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import latency_histogram
+import migrations
+
+# The schema version that added the stored histograms; the session table is older.
+HISTOGRAM_VERSION = 7
+
+
+def connect_read_only(db_path):
+    return sqlite3.connect(pathlib.Path(db_path).resolve().as_uri() + "?mode=ro", uri=True)
+
+
+def shard_summary(db_path, top_k=10):
+    conn = connect_read_only(db_path)
+    version = migrations.schema_version(conn)
+    if version < HISTOGRAM_VERSION:
+        conn.close()
+        raise ValueError(f"{db_path} is at schema version {version}; migrate it first")
+    sessions, turns, v2v_count, v2v_sum, interrupted = conn.execute(
+        """
+        SELECT COUNT(*), COALESCE(SUM(num_turns), 0), COALESCE(SUM(v2v_count), 0),
+          COALESCE(SUM(v2v_sum), 0), COALESCE(SUM(num_interrupted), 0)
+        FROM session
+        """
+    ).fetchone()
+    histogram = Counter(dict(conn.execute("SELECT bin, SUM(count) FROM latency_histogram GROUP BY bin")))
+    for (v2v,) in conn.execute(
+        """
+        SELECT voice_to_voice_response_time FROM conversation_turn
+        WHERE id > (SELECT last_turn_id FROM latency_histogram_state)
+          AND voice_to_voice_response_time IS NOT NULL
+        """
+    ):
+        histogram[latency_histogram.bin_index(v2v)] += 1
+    slowest = [
+        (v2v, db_path, session_id, turn_number, turn_start)
+        for session_id, turn_number, turn_start, v2v in conn.execute(
+            """
+            SELECT session_id, turn_number, turn_start_time, voice_to_voice_response_time
+            FROM conversation_turn
+            WHERE voice_to_voice_response_time IS NOT NULL
+            ORDER BY voice_to_voice_response_time DESC
+            LIMIT ?
+            """,
+            (top_k,),
+        )
+    ]
+    conn.close()
+    return {
+        "db": db_path,
+        "sessions": sessions,
+        "turns": turns,
+        "v2v_count": v2v_count,
+        "v2v_sum": v2v_sum,
+        "interrupted": interrupted,
+        "histogram": dict(histogram),
+        "slowest": slowest,
+    }
+
+
+def merge_summaries(summaries, top_k=10):
+    merged = {
+        "sessions": 0,
+        "turns": 0,
+        "v2v_count": 0,
+        "v2v_sum": 0.0,
+        "interrupted": 0,
+        "histogram": latency_histogram.LatencyHistogram(),
+        "slowest": [],
+    }
+    for summary in summaries:
+        for key in ("sessions", "turns", "v2v_count", "v2v_sum", "interrupted"):
+            merged[key] += summary[key]
+        merged["histogram"].merge(latency_histogram.LatencyHistogram(summary["histogram"]))
+        merged["slowest"] = heapq.nlargest(top_k, merged["slowest"] + summary["slowest"])
+    return merged
+
+
+def fleet_summary(db_paths, top_k=10, workers=None):
+    """Summarize each shard in a process pool. Returns (per-shard summaries, merged summary)."""
+    if len(db_paths) == 1:
+        summaries = [shard_summary(db_paths[0], top_k)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            summaries = list(pool.map(shard_summary, db_paths, [top_k] * len(db_paths)))
+    return summaries, merge_summaries(summaries, top_k)
@@ -0,0 +1,150 @@
+"""
+Cached per-session voice-to-voice percentiles.
+
+Counts, sums and interruptions per session are already kept up to date in the session
+table by a trigger. Percentiles can't be updated that way, so they are cached in the
+session_percentile table, one row per session and percentile. session_percentile_state
+records, for each percentile, the conversation_turn.id the cache is up to date with.
+
+`refresh()` looks at the turns past that watermark, finds the sessions they belong to,
+and recomputes only those sessions. On a big db after a few new calls, that is a handful
+of small index lookups. The first time a percentile is asked for, it is computed for
+every session at once with latency_analytics.
+
+Refreshing writes to the db, so it only happens when asked for
+(`analyze_conversations.py refresh-caches`). Reading the cache never writes.
+"""
+
+import numpy as np
+
+import latency_analytics
+
+# Beyond this many changed sessions, reading every turn in one pass is faster than
+# looking sessions up one chunk at a time.
+FULL_SCAN_SESSIONS = 2000
+
+# Stay well under sqlite's limit on query parameters.
+CHUNK_SIZE = 500
+
+
+def _changed_turns(conn, watermark, new_watermark):
+    if watermark == 0:
+        return latency_analytics.load_turns(conn, "WHERE id <= ?", (new_watermark,))
+    session_ids = [
+        row[0]
+        for row in conn.execute(
+            "SELECT DISTINCT session_id FROM conversation_turn WHERE id > ? AND id <= ?",
+            (watermark, new_watermark),
+        )
+    ]
+    if len(session_ids) > FULL_SCAN_SESSIONS:
+        return latency_analytics.load_turns(conn, "WHERE id <= ?", (new_watermark,))
+    chunks = []
+    for i in range(0, len(session_ids), CHUNK_SIZE):
+        chunk = session_ids[i : i + CHUNK_SIZE]
+        chunks.append(
+            latency_analytics.load_turns(
+                conn,
+                f"WHERE session_id IN ({', '.join('?' * len(chunk))}) AND id <= ?",
+                (*chunk, new_watermark),
+            )
+        )
+    if not chunks:
+        return latency_analytics.load_turns(conn, "WHERE 0")
+    return latency_analytics.TurnArrays(
+        *(
+            np.concatenate([getattr(turns, name) for turns in chunks])
+            for name in ("session_ids", "v2v", "interrupted", "turn_start_time")
+        )
+    )
+
+
+def refresh(conn, percents):
+    """
+    Bring the cached percentiles up to date with every turn in the db. Returns the
+    number of sessions recomputed. Runs in one write transaction, so the cache and its
+    watermarks always move together.
+    """
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            watermarks = dict(
+                conn.execute("SELECT percent, last_turn_id FROM session_percentile_state")
+            )
+            watermark = min(watermarks.get(percent, 0) for percent in percents)
+            new_watermark = conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM conversation_turn"
+            ).fetchone()[0]
+            recomputed = 0
+            if watermark < new_watermark:
+                turns = _changed_turns(conn, watermark, new_watermark)
+                stats = latency_analytics.session_stats(turns, percents)
+                recomputed = len(stats)
+                for percent in percents:
+                    values = stats.v2v_percentiles[percent]
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO session_percentile (session_id, percent, v2v) VALUES (?, ?, ?)",
+                        (
+                            (session_id, percent, None if np.isnan(value) else float(value))
+                            for session_id, value in zip(stats.session_ids, values)
+                        ),
+                    )
+            conn.executemany(
+                "INSERT OR REPLACE INTO session_percentile_state (percent, last_turn_id) VALUES (?, ?)",
+                ((percent, new_watermark) for percent in percents),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.isolation_level = isolation_level
+    return recomputed
+
+
+def cached_session_stats(conn, percents):
+    """
+    latency_analytics.SessionStats for every session, from the session table and the
+    cache, as of the last refresh. Read-only. Percentiles that were never cached are NaN.
+    """
+    joins = "".join(
+        f" LEFT JOIN session_percentile p{i} ON p{i}.session_id = s.session_id AND p{i}.percent = ?"
+        for i in range(len(percents))
+    )
+    cursor = conn.execute(
+        f"""
+        SELECT s.session_id, s.first_turn_start_time, s.num_turns, s.v2v_count, s.v2v_sum,
+          s.num_interrupted{"".join(f", p{i}.v2v" for i in range(len(percents)))}
+        FROM session s{joins}
+        ORDER BY s.first_turn_start_time
+        """,
+        tuple(percents),
+    )
+    columns = [[] for _ in range(6 + len(percents))]
+    while True:
+        rows = cursor.fetchmany(latency_analytics.FETCH_SIZE)
+        if not rows:
+            break
+        for column, values in zip(columns, zip(*rows)):
+            column.extend(values)
+    num_turns = np.array(columns[2], dtype=np.int64)
+    v2v_count = np.array(columns[3], dtype=np.int64)
+    v2v_sum = np.array(columns[4], dtype=np.float64)
+    # None becomes NaN
+    v2v_percentiles = {
+        percent: np.array(columns[6 + i], dtype=np.float64) for i, percent in enumerate(percents)
+    }
+    with np.errstate(invalid="ignore", divide="ignore"):
+        v2v_mean = np.where(v2v_count > 0, v2v_sum / v2v_count, np.nan)
+        interruption_rate = np.array(columns[5], dtype=np.float64) / num_turns
+    return latency_analytics.SessionStats(
+        np.array(columns[0], dtype=object),
+        num_turns,
+        np.array(columns[1], dtype=np.float64),
+        v2v_count,
+        v2v_mean,
+        v2v_percentiles,
+        interruption_rate,
+    )
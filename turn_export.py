@@ -0,0 +1,186 @@
+"""
+Export conversation turns to date-partitioned Parquet files for offline analysis.
+
+    python turn_export.py [--db PATH] [--out DIR]
+
+Turns are streamed out of the db in batches of BATCH_SIZE rows, in conversation_turn.id
+order, over a read-only connection. That means the export never blocks the bots'
+writes. Each run only exports turns with an id greater than the last run's, and writes
+them to new files:
+
+    DIR/date=2025-06-09/part-00000000000000054759.parquet
+
+The date is the UTC date of the turn's start time, and the number is the first id the run
+exported. If a run dies before it finishes, the next run starts from the same id and
+overwrites the partial files, so no turns are written twice. The last exported id is
+kept in DIR/_export_state.json.
+
+`load_turns()` reads the files back as memory-mapped Arrow tables. Only the columns
+asked for are read, so a latency scan never touches the transcript text.
+
+Needs pyarrow.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import sqlite3
+
+DB_PATH = os.path.join(os.path.dirname(__file__), "db-and-recordings/conversation_turns.db")
+EXPORT_DIR = os.path.join(os.path.dirname(__file__), "db-and-recordings/turns-parquet")
+STATE_FILE = "_export_state.json"
+
+BATCH_SIZE = 50000
+
+COLUMNS = (
+    "id",
+    "session_id",
+    "turn_number",
+    "turn_start_time",
+    "turn_end_time",
+    "user_speech_text",
+    "llm_response_text",
+    "voice_to_voice_response_time",
+    "interrupted",
+    "audio_start_sample",
+    "audio_end_sample",
+    "audio_sample_rate",
+)
+
+
+def schema():
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("session_id", pa.string()),
+            ("turn_number", pa.int64()),
+            ("turn_start_time", pa.float64()),
+            ("turn_end_time", pa.float64()),
+            ("user_speech_text", pa.string()),
+            ("llm_response_text", pa.string()),
+            ("voice_to_voice_response_time", pa.float64()),
+            ("interrupted", pa.bool_()),
+            ("audio_start_sample", pa.int64()),
+            ("audio_end_sample", pa.int64()),
+            ("audio_sample_rate", pa.int64()),
+        ]
+    )
+
+
+def to_arrow(column, arrow_type):
+    import pyarrow as pa
+
+    if arrow_type == pa.bool_():
+        # sqlite stores booleans as 0/1
+        return pa.array(column, type=pa.int64()).cast(arrow_type)
+    return pa.array(column, type=arrow_type)
+
+
+def read_state(out_dir):
+    try:
+        with open(os.path.join(out_dir, STATE_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"last_turn_id": 0}
+
+
+def write_state(out_dir, state):
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def partition_date(turn_start_time):
+    return datetime.datetime.fromtimestamp(turn_start_time, datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+def export(db_path=DB_PATH, out_dir=EXPORT_DIR, batch_size=BATCH_SIZE):
+    """Append turns added since the last export. Returns the number of turns exported."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(out_dir, exist_ok=True)
+    watermark = read_state(out_dir)["last_turn_id"]
+    file_name = f"part-{watermark + 1:020d}.parquet"
+    turn_schema = schema()
+
+    conn = sqlite3.connect(pathlib.Path(db_path).resolve().as_uri() + "?mode=ro", uri=True)
+    # a single SELECT sees one snapshot of the db, however long it takes to read
+    cursor = conn.execute(
+        f"SELECT {', '.join(COLUMNS)} FROM conversation_turn WHERE id > ? ORDER BY id",
+        (watermark,),
+    )
+    writers = {}
+    exported = 0
+    last_id = watermark
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            by_date = {}
+            for row in rows:
+                by_date.setdefault(partition_date(row[3]), []).append(row)
+            for date, date_rows in by_date.items():
+                writer = writers.get(date)
+                if writer is None:
+                    partition = os.path.join(out_dir, f"date={date}")
+                    os.makedirs(partition, exist_ok=True)
+                    writer = writers[date] = pq.ParquetWriter(
+                        os.path.join(partition, "." + file_name), turn_schema
+                    )
+                columns = list(zip(*date_rows))
+                writer.write_table(
+                    pa.Table.from_arrays(
+                        [to_arrow(column, field.type) for column, field in zip(columns, turn_schema)],
+                        schema=turn_schema,
+                    )
+                )
+            exported += len(rows)
+            last_id = rows[-1][0]
+    finally:
+        conn.close()
+        for writer in writers.values():
+            writer.close()
+
+    for date in writers:
+        partition = os.path.join(out_dir, f"date={date}")
+        os.replace(os.path.join(partition, "." + file_name), os.path.join(partition, file_name))
+    if exported:
+        write_state(out_dir, {"last_turn_id": last_id})
+    return exported
+
+
+def load_turns(out_dir=EXPORT_DIR, columns=None):
+    """Read the exported turns as one Arrow table, memory-mapping the files and only reading `columns`."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    return pq.read_table(
+        out_dir,
+        columns=list(columns) if columns else None,
+        memory_map=True,
+        partitioning="hive",
+        # given explicitly so that an empty export still reads as an empty table
+        schema=schema().append(pa.field("date", pa.date32())),
+        # skip the state file and any files a crashed export left behind
+        ignore_prefixes=["_", "."],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export new conversation turns to date-partitioned Parquet files.")
+    parser.add_argument("--db", default=DB_PATH, help=f"Conversation db (default: {DB_PATH}).")
+    parser.add_argument("--out", default=EXPORT_DIR, help=f"Output directory (default: {EXPORT_DIR}).")
+    args = parser.parse_args()
+    exported = export(args.db, args.out)
+    print(f"Exported {exported} turns to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
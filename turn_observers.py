@@ -0,0 +1,162 @@
+#
+# Copyright (c) 2025, Daily
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+"""
+Pipeline observers that record per-turn data for the conversation db.
+
+Observers see every frame as it is pushed from one processor to the next, and they
+don't have to sit in the pipeline, so they add no latency to it.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from pipecat.frames.frames import (
+    BotStartedSpeakingFrame,
+    LLMTextFrame,
+    MetricsFrame,
+    TranscriptionFrame,
+    TTSAudioRawFrame,
+    UserStoppedSpeakingFrame,
+)
+from pipecat.metrics.metrics import (
+    LLMUsageMetricsData,
+    ProcessingMetricsData,
+    TTFBMetricsData,
+    TTSUsageMetricsData,
+)
+from pipecat.observers.base_observer import BaseObserver, FramePushed
+from pipecat.services.llm_service import LLMService
+from pipecat.services.stt_service import STTService
+from pipecat.services.tts_service import TTSService
+from pipecat.transports.base_input import BaseInputTransport
+from pipecat.transports.base_output import BaseOutputTransport
+
+from turn_store import TurnStore
+
+INSERT_STAGE_TIMING_SQL = "INSERT OR IGNORE INTO turn_stage_timing (session_id, turn_number, vad_stop_ns, stt_final_ns, llm_first_token_ns, tts_first_audio_ns, first_audio_out_ns) VALUES (?, ?, ?, ?, ?, ?, ?)"
+
+INSERT_SERVICE_METRIC_SQL = "INSERT INTO service_metric (session_id, turn_number, service, model, metric, value) VALUES (?, ?, ?, ?, ?, ?)"
+
+# In the order they happen in a normal turn.
+STAGES = (
+    "vad_stop",
+    "stt_final",
+    "llm_first_token",
+    "tts_first_audio",
+    "first_audio_out",
+)
+
+
+class StageTimingObserver(BaseObserver):
+    """
+    Breaks each turn's voice-to-voice time down by stage: VAD stop, final STT
+    transcript, first LLM token, first TTS audio, and first audio out of the transport.
+
+    Timestamps come from the pipeline clock (monotonic nanoseconds) and are taken when
+    the frame is pushed, not when the observer gets around to seeing it. Each frame is
+    only counted when the processor that produced it pushes it, not every time it is
+    passed along.
+
+    Stages are stored in nanoseconds relative to the user's VAD stop. The bot's greeting
+    has no user speech, so it is stored relative to its earliest recorded stage.
+    """
+
+    def __init__(self, session_id: str, store: TurnStore):
+        super().__init__()
+        self._session_id = session_id
+        self._store = store
+        self._stages: Dict[str, int] = {}
+
+    def _responding(self) -> bool:
+        return "llm_first_token" in self._stages
+
+    async def on_push_frame(self, data: FramePushed):
+        frame = data.frame
+        src = data.src
+        if isinstance(frame, UserStoppedSpeakingFrame):
+            # the user may pause and carry on, so keep the last stop before the bot
+            # starts responding
+            if isinstance(src, BaseInputTransport) and not self._responding():
+                self._stages["vad_stop"] = data.timestamp
+        elif isinstance(frame, TranscriptionFrame):
+            if isinstance(src, STTService) and not self._responding():
+                self._stages["stt_final"] = data.timestamp
+        elif isinstance(frame, LLMTextFrame):
+            if isinstance(src, LLMService):
+                self._stages.setdefault("llm_first_token", data.timestamp)
+        elif isinstance(frame, TTSAudioRawFrame):
+            if isinstance(src, TTSService):
+                self._stages.setdefault("tts_first_audio", data.timestamp)
+        elif isinstance(frame, BotStartedSpeakingFrame):
+            if isinstance(src, BaseOutputTransport):
+                self._stages.setdefault("first_audio_out", data.timestamp)
+
+    async def end_turn(self, turn_number: int):
+        stages, self._stages = self._stages, {}
+        if not stages:
+            return
+        reference = stages.get("vad_stop", min(stages.values()))
+        relative: Dict[str, Optional[int]] = {
+            stage: stages[stage] - reference if stage in stages else None
+            for stage in STAGES
+        }
+        logger.debug(f"Turn {turn_number} stage timing (ns): {relative}")
+        await self._store.enqueue(
+            INSERT_STAGE_TIMING_SQL,
+            (self._session_id, turn_number, *(relative[stage] for stage in STAGES)),
+        )
+
+
+class ServiceMetricsObserver(BaseObserver):
+    """
+    Saves the metrics that PipelineParams(enable_metrics=True, enable_usage_metrics=True)
+    makes each service emit: TTFB, processing time, LLM token usage and TTS characters.
+
+    Metrics are buffered in memory until their turn ends, then written as one batch to
+    the service_metric table, one row per value. Anything left over when the session ends
+    is written by `flush()` with a NULL turn number.
+    """
+
+    def __init__(self, session_id: str, store: TurnStore):
+        super().__init__()
+        self._session_id = session_id
+        self._store = store
+        self._pending: List[Tuple[str, Optional[str], str, float]] = []
+
+    async def on_push_frame(self, data: FramePushed):
+        if not isinstance(data.frame, MetricsFrame):
+            return
+        for metric in data.frame.data:
+            # a MetricsFrame travels through every processor downstream of the service
+            # that made it, so only count it when that service pushes it
+            if metric.processor != data.src.name:
+                continue
+            if isinstance(metric, TTFBMetricsData):
+                values = [("ttfb", metric.value)]
+            elif isinstance(metric, ProcessingMetricsData):
+                values = [("processing", metric.value)]
+            elif isinstance(metric, LLMUsageMetricsData):
+                values = [
+                    ("prompt_tokens", metric.value.prompt_tokens),
+                    ("completion_tokens", metric.value.completion_tokens),
+                ]
+            elif isinstance(metric, TTSUsageMetricsData):
+                values = [("tts_characters", metric.value)]
+            else:
+                continue
+            for name, value in values:
+                self._pending.append((metric.processor, metric.model, name, value))
+
+    async def end_turn(self, turn_number: Optional[int]):
+        pending, self._pending = self._pending, []
+        await self._store.enqueue_many(
+            INSERT_SERVICE_METRIC_SQL,
+            [(self._session_id, turn_number, *metric) for metric in pending],
+        )
+
+    async def flush(self):
+        await self.end_turn(None)
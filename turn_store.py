@@ -0,0 +1,262 @@
+#
+# Copyright (c) 2025, Daily
+#
+# SPDX-License-Identifier: BSD 2-Clause License
+#
+
+import asyncio
+import itertools
+import random
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from loguru import logger
+
+import migrations
+
+DB_PATH = "./db-and-recordings/conversation_turns.db"
+
+# A turn that was somehow saved twice is dropped rather than failing the whole batch it
+# was committed with. (session_id, turn_number) is unique.
+INSERT_TURN_SQL = "INSERT OR IGNORE INTO conversation_turn (session_id, turn_number, turn_start_time, turn_end_time, user_speech_text, llm_response_text, voice_to_voice_response_time, interrupted, audio_start_sample, audio_end_sample, audio_sample_rate) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+# Queue item used to tell the writer task to drain and exit.
+_STOP = None
+
+# How long sqlite itself waits on a lock before raising "database is locked", and how
+# many times we retry after that (with jittered backoff) before giving up.
+BUSY_TIMEOUT_MS = 5000
+LOCKED_RETRIES = 5
+LOCKED_BACKOFF_S = 0.05
+
+
+def _is_locked_error(e: sqlite3.OperationalError) -> bool:
+    message = str(e).lower()
+    return "database is locked" in message or "database is busy" in message
+
+
+def _retry_if_locked(fn: Callable[[], Any]) -> Any:
+    for attempt in range(LOCKED_RETRIES + 1):
+        try:
+            return fn()
+        except sqlite3.OperationalError as e:
+            if not _is_locked_error(e) or attempt == LOCKED_RETRIES:
+                raise
+            delay = LOCKED_BACKOFF_S * (2**attempt) * (0.5 + random.random())
+            logger.warning(f"{e}, retrying in {delay * 1000:.0f} ms")
+            time.sleep(delay)
+
+
+class TurnWriter:
+    """Writes rows for every session in the process from one background thread.
+
+    Rows are queued from the event loop with `enqueue()` and group-committed with
+    `executemany` by a single worker thread, so a slow INSERT or fsync never runs on the
+    loop that is moving audio. The queue is bounded: when it is full, `enqueue()` waits
+    until the writer catches up.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], sqlite3.Connection],
+        max_queue_size: int = 1000,
+        max_batch_size: int = 200,
+        slow_commit_ms: float = 100.0,
+    ):
+        self._connect = connect
+        self._max_queue_size = max_queue_size
+        self._max_batch_size = max_batch_size
+        self._slow_commit_ms = slow_commit_ms
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._connection: Optional[sqlite3.Connection] = None
+        self._closing = False
+
+        self._rows_written = 0
+        self._rows_failed = 0
+        self._commits = 0
+        self._last_commit_ms = 0.0
+        self._max_commit_ms = 0.0
+        self._total_commit_ms = 0.0
+
+    def _start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self._max_queue_size)
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="turn-writer"
+            )
+            self._task = asyncio.create_task(self._run())
+
+    async def enqueue(self, sql: str, params: Sequence[Any]):
+        await self.enqueue_many(sql, [params])
+
+    async def enqueue_many(self, sql: str, rows: Sequence[Sequence[Any]]):
+        """Queue several rows for the same statement as one item."""
+        if self._closing:
+            raise RuntimeError("TurnWriter is closed")
+        if not rows:
+            return
+        self._start()
+        await self._queue.put((sql, [tuple(params) for params in rows]))
+
+    async def flush(self):
+        """Wait until every row queued so far has been committed."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self):
+        """Commit everything still queued, then stop the writer thread."""
+        if self._task is None:
+            return
+        self._closing = True
+        await self._queue.put(_STOP)
+        await self._task
+        await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._close_connection
+        )
+        self._executor.shutdown()
+        logger.info(f"TurnWriter closed: {self.stats()}")
+        self._queue = None
+        self._task = None
+        self._executor = None
+        self._closing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "rows_written": self._rows_written,
+            "rows_failed": self._rows_failed,
+            "commits": self._commits,
+            "last_commit_ms": round(self._last_commit_ms, 3),
+            "avg_commit_ms": round(self._total_commit_ms / self._commits, 3)
+            if self._commits
+            else 0.0,
+            "max_commit_ms": round(self._max_commit_ms, 3),
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            # Block for the first item, then take whatever else piled up while the
+            # previous commit was running. That backlog becomes one transaction.
+            items = [await self._queue.get()]
+            while len(items) < self._max_batch_size and not self._queue.empty():
+                items.append(self._queue.get_nowait())
+            batch = [item for item in items if item is not _STOP]
+            stopping = len(batch) != len(items)
+            if batch:
+                try:
+                    await loop.run_in_executor(self._executor, self._commit, batch)
+                except Exception as e:
+                    num_rows = sum(len(rows) for _, rows in batch)
+                    self._rows_failed += num_rows
+                    logger.exception(f"TurnWriter failed to commit {num_rows} rows: {e}")
+            for _ in items:
+                self._queue.task_done()
+
+    def _commit(self, batch: List[Tuple[str, List[Tuple[Any, ...]]]]):
+        # Runs on the writer thread. The connection is only ever touched from here.
+        if self._connection is None:
+            self._connection = self._connect()
+
+        def write_batch():
+            with self._connection:
+                # Consecutive rows for the same statement go out in one executemany
+                # call. Order across statements is kept.
+                for sql, group in itertools.groupby(batch, key=lambda item: item[0]):
+                    self._connection.executemany(
+                        sql, [params for _, rows in group for params in rows]
+                    )
+
+        start = time.perf_counter()
+        _retry_if_locked(write_batch)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        num_rows = sum(len(rows) for _, rows in batch)
+        self._rows_written += num_rows
+        self._commits += 1
+        self._last_commit_ms = elapsed_ms
+        self._total_commit_ms += elapsed_ms
+        self._max_commit_ms = max(self._max_commit_ms, elapsed_ms)
+        if elapsed_ms > self._slow_commit_ms:
+            logger.warning(
+                f"Slow turn commit: {num_rows} rows in {elapsed_ms:.1f} ms, queue depth {self._queue.qsize()}"
+            )
+        else:
+            logger.debug(
+                f"Committed {num_rows} rows in {elapsed_ms:.1f} ms, queue depth {self._queue.qsize()}"
+            )
+
+    def _close_connection(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class TurnStore:
+    """Process-wide access to the conversation database.
+
+    All concurrent sessions share one store. It owns the only writer connection, in WAL
+    mode and driven by a `TurnWriter`. WAL means readers in other processes (the
+    analysis scripts) never block the writer. Sessions register when they start and flush
+    their queued turns when they unregister. `close()` shuts everything down.
+    """
+
+    def __init__(
+        self,
+        db_path: str = DB_PATH,
+        **writer_kwargs,
+    ):
+        self.db_path = db_path
+        self.writer = TurnWriter(self._connect_writer, **writer_kwargs)
+        self._sessions: Set[str] = set()
+        self._closed = False
+
+    def _connect_writer(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_path)
+        connection.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        connection.execute("PRAGMA journal_mode = WAL")
+        # In WAL mode NORMAL only fsyncs at checkpoints. A power loss can drop the last
+        # few commits, but it can't corrupt the file.
+        connection.execute("PRAGMA synchronous = NORMAL")
+        _retry_if_locked(lambda: migrations.migrate(connection))
+        return connection
+
+    def register_session(self, session_id: str):
+        if self._closed:
+            raise RuntimeError("TurnStore is closed")
+        self._sessions.add(session_id)
+        logger.debug(f"Registered session {session_id}, {len(self._sessions)} active")
+
+    async def unregister_session(self, session_id: str):
+        self._sessions.discard(session_id)
+        await self.writer.flush()
+        logger.debug(f"Unregistered session {session_id}, {len(self._sessions)} active")
+
+    @property
+    def active_sessions(self) -> int:
+        return len(self._sessions)
+
+    async def enqueue(self, sql: str, params: Sequence[Any]):
+        await self.writer.enqueue(sql, params)
+
+    async def enqueue_many(self, sql: str, rows: Sequence[Sequence[Any]]):
+        await self.writer.enqueue_many(sql, rows)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"active_sessions": self.active_sessions, **self.writer.stats()}
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._sessions:
+            logger.warning(
+                f"Closing TurnStore with {len(self._sessions)} sessions still active"
+            )
+        await self.writer.close()